@@ -0,0 +1,318 @@
+import cv2
+import numpy as np
+import face_metrics
+from face_detectors import create_detector, DEFAULT_FACE_DETECTOR, FACE_DETECTORS
+from face_tracking import FaceTracker
+from timeline import RunBuilder, Timeline, NORMAL_VALUES, SIGNALS
+
+DEFAULT_FPS = 30.0
+
+# Adaptive sampling: analyze every `stride`-th frame on average, and every
+# frame for DENSE_FRAMES after something changes between two samples. Gaps
+# between samples vary between stride / 2 and 3 * stride / 2 frames, so
+# periodic motion (blinking, speech) doesn't alias with the stride. Each
+# sample's signals are held until the next sample, so a transition outside
+# a dense window is misplaced by at most 3 * stride / 2 frames. While the
+# face tracker is confirming a new face or dropping a lost one, the next
+# frame is sampled too, so face counts settle within a few frames.
+# Lip movement is measured between a sample and the frame just before it,
+# which is decoded too, so a sample's lips flag means the same at any
+# stride. It flickers from frame to frame, so it never makes sampling
+# dense: measuring every frame only after flagged samples would correct
+# their overestimates but not the underestimates of unflagged ones, and
+# bias the duration low.
+DEFAULT_STRIDE = 10
+DENSE_FRAMES = 30
+HEAD_POSE_THRESHOLD = 0.15  # Change in nose offset, relative to eye distance
+MOTION_THRESHOLD = 12.0  # Mean absolute pixel change on a 64x48 grayscale thumbnail
+MOTION_SIZE = (64, 48)
+
+# Landmark arrays are buffered and turned into metrics this many samples at a time
+WINDOW_SIZE = 256
+
+# Backends without landmarks estimate lip movement from how much the mouth
+# region of the largest face changes between samples, beyond the change of
+# the upper face (which moves with the head)
+MOUTH_SIZE = (32, 16)
+MOUTH_MOTION_THRESHOLD = 6.0
+
+_face_mesh = None
+_detectors = {}
+
+
+def _get_face_mesh():
+    # One FaceMesh per process, reused across videos
+    global _face_mesh
+    if _face_mesh is None:
+        import mediapipe as mp
+        _face_mesh = mp.solutions.face_mesh.FaceMesh(
+            max_num_faces=2,
+            refine_landmarks=True,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5)
+    return _face_mesh
+
+
+def _get_detector(name):
+    # One detector per backend and process, reused across videos
+    if name not in _detectors:
+        _detectors[name] = create_detector(name)
+    return _detectors[name]
+
+
+class FrameSample:
+    # Face count (confirmed FaceTracker tracks, so a face missed or
+    # misdetected in a frame or two doesn't change it), metric landmarks and
+    # motion thumbnail for one analyzed frame. Samples from backends without
+    # landmarks carry their (eyes_off_screen, lips_moving) estimates instead.
+    def __init__(self, index, face_count, points, thumbnail, estimates=None):
+        self.index = index
+        self.face_count = face_count
+        self.points = points
+        self.thumbnail = thumbnail
+        self.estimates = estimates
+        self.regions = None  # Mouth and upper face crops, for the next sample's estimate
+        self.head_pose = face_metrics.head_pose(points[np.newaxis])[0] if face_count and estimates is None else None
+        self.aperture = face_metrics.lip_aperture(points[np.newaxis])[0] if estimates is None else None
+        self.previous_aperture = np.nan  # In the frame just before this one, if it was analyzed
+
+
+class MetricsAccumulator:
+    # Buffers per-sample landmark arrays and reduces whole windows of them to
+    # runs of eyes-off-screen, lips-moving and face-count frames. Each sample
+    # stands for the frames up to the next sample, so sparse samples cover
+    # their whole span.
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.window_size = window_size
+        self.indices = []
+        self.points = []
+        self.face_counts = []
+        self.estimates = []
+        self.previous_apertures = []
+        self.runs = {signal: RunBuilder(NORMAL_VALUES[signal]) for signal in SIGNALS}
+
+    def add(self, sample):
+        self.indices.append(sample.index)
+        self.points.append(sample.points)
+        self.face_counts.append(sample.face_count)
+        self.estimates.append(sample.estimates)
+        self.previous_apertures.append(sample.previous_aperture)
+        if len(self.indices) > self.window_size:
+            # The last sample's weight depends on the next one, so keep it
+            self._reduce(len(self.indices) - 1, self.indices[-1])
+
+    def finish(self, frame_count):
+        if self.indices:
+            self._reduce(len(self.indices), frame_count)
+
+    def _reduce(self, count, end_index):
+        indices = np.asarray(self.indices[:count] + [end_index])
+        starts, ends = indices[:-1], indices[1:]
+
+        if self.estimates[0] is None:
+            points = np.stack(self.points[:count])
+            aperture = face_metrics.lip_aperture(points)
+            eyes_off = face_metrics.eyes_off_screen(points)
+            lips_moving = face_metrics.lips_moving(aperture, np.asarray(self.previous_apertures[:count], dtype=np.float32))
+        else:
+            estimates = np.asarray(self.estimates[:count], dtype=bool).reshape(-1, 2)
+            eyes_off, lips_moving = estimates[:, 0], estimates[:, 1]
+
+        self.runs['eyes_off_screen'].add(starts, ends, eyes_off.astype(np.int32))
+        self.runs['lips_moving'].add(starts, ends, lips_moving.astype(np.int32))
+        self.runs['face_count'].add(starts, ends, np.asarray(self.face_counts[:count], dtype=np.int32))
+
+        del self.indices[:count]
+        del self.points[:count]
+        del self.face_counts[:count]
+        del self.estimates[:count]
+        del self.previous_apertures[:count]
+
+
+def _face_mesh_faces(face_mesh, frame):
+    return face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).multi_face_landmarks or []
+
+
+def _first_face_points(faces):
+    return face_metrics.landmarks_to_array(faces[0].landmark) if faces else face_metrics.no_face_array()
+
+
+def _analyze_frame(face_mesh, tracker, frame, index, with_thumbnail, previous, reference):
+    # reference is the frame before this one when it wasn't analyzed itself.
+    # The faces FaceMesh finds are the tracker's detections.
+    previous_aperture = np.nan
+    if reference is not None:
+        # Processed first, as FaceMesh tracks faces from frame to frame
+        reference_points = _first_face_points(_face_mesh_faces(face_mesh, reference))
+        previous_aperture = face_metrics.lip_aperture(reference_points[np.newaxis])[0]
+    elif previous is not None and previous.index == index - 1:
+        previous_aperture = previous.aperture
+
+    faces = _face_mesh_faces(face_mesh, frame)
+    people = tracker.update(frame, face_metrics.face_boxes(faces, frame.shape[1], frame.shape[0]))
+    points = _first_face_points(faces)
+
+    thumbnail = None
+    if with_thumbnail:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+
+    sample = FrameSample(index, len(people), points, thumbnail)
+    sample.previous_aperture = previous_aperture
+    return sample
+
+
+def _face_regions(gray, box):
+    # Mouth (lower third, middle three fifths) and upper half of a face box,
+    # at a fixed small size so samples compare cheaply
+    x1, y1, x2, y2 = np.round(box).astype(int)
+    height, width = gray.shape
+    x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+    face_width, face_height = x2 - x1, y2 - y1
+    if face_width < 10 or face_height < 10:
+        return None
+    mouth = gray[y1 + face_height * 2 // 3:y2, x1 + face_width // 5:x2 - face_width // 5]
+    upper = gray[y1:y1 + face_height // 2, x1:x2]
+    return (cv2.resize(mouth, MOUTH_SIZE, interpolation=cv2.INTER_AREA),
+            cv2.resize(upper, MOUTH_SIZE, interpolation=cv2.INTER_AREA))
+
+
+def _analyze_frame_boxes(tracker, frame, index, with_thumbnail, previous, reference):
+    # Cheaper, coarser signals from a face detector without landmarks, run
+    # through the tracker so most frames follow the faces instead of
+    # detecting them: a student whose face isn't seen facing the camera
+    # counts as looking away, and lips count as moving when the mouth region
+    # changes more than the rest of the face since the frame before. A
+    # reference frame is cropped with this frame's face box.
+    people = tracker.update(frame)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, MOTION_SIZE, interpolation=cv2.INTER_AREA) if with_thumbnail else None
+    # Tracks kept through a missed detection still count as people, but
+    # not as a face seen in this frame
+    boxes = [track.box for track in people if track.misses == 0]
+    if not boxes:
+        return FrameSample(index, len(people), face_metrics.no_face_array(), thumbnail, (True, False))
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    largest = boxes[np.argmax((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))]
+    regions = _face_regions(gray, largest)
+    before = None
+    if reference is not None:
+        before = _face_regions(cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY), largest)
+    elif previous is not None and previous.index == index - 1:
+        before = previous.regions
+    lips_moving = False
+    if regions is not None and before is not None:
+        mouth_change = cv2.absdiff(regions[0], before[0]).mean()
+        face_change = cv2.absdiff(regions[1], before[1]).mean()
+        lips_moving = mouth_change - face_change > MOUTH_MOTION_THRESHOLD
+
+    sample = FrameSample(index, len(people), face_metrics.no_face_array(), thumbnail, (False, bool(lips_moving)))
+    sample.regions = regions
+    return sample
+
+
+def _changed(previous, sample):
+    # Whether anything changed enough between two samples to analyze densely
+    if previous.face_count != sample.face_count:
+        return True
+    if previous.head_pose is not None and sample.head_pose is not None:
+        if abs(sample.head_pose - previous.head_pose) > HEAD_POSE_THRESHOLD:
+            return True
+    if previous.thumbnail is not None and sample.thumbnail is not None:
+        if cv2.absdiff(previous.thumbnail, sample.thumbnail).mean() > MOTION_THRESHOLD:
+            return True
+    return False
+
+
+def _frame_duration(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    # Browser recordings often report a bogus frame rate
+    if not fps or fps <= 0 or fps > 240:
+        fps = DEFAULT_FPS
+    return 1.0 / fps
+
+
+def analyze_video(video_path, stride=1, face_detector=DEFAULT_FACE_DETECTOR):
+    # Run face analysis over a recording without any display and return the
+    # durations stored in UserMetrics, in seconds, and the encoded timeline
+    # they were derived from. With stride > 1 only every
+    # stride-th frame is analyzed, with the frame before it for lip
+    # movement, switching to every frame around changes, and durations are
+    # extrapolated from the frames each sample stands for.
+    # The mediapipe backend runs FaceMesh; the others estimate the signals
+    # from face boxes. Face counts come from a FaceTracker over the samples.
+    if face_detector not in FACE_DETECTORS:
+        raise ValueError(f'Unknown face detector {face_detector}')
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f'Could not open video {video_path}')
+
+    if FACE_DETECTORS[face_detector].landmarks:
+        face_mesh = _get_face_mesh()
+        # FaceMesh runs on every sample anyway and supplies the detections
+        tracker = FaceTracker(None, detect_interval=1)
+        analyze_frame = lambda frame, index, previous, reference: _analyze_frame(face_mesh, tracker, frame, index, adaptive, previous, reference)
+    else:
+        tracker = FaceTracker(_get_detector(face_detector))
+        analyze_frame = lambda frame, index, previous, reference: _analyze_frame_boxes(tracker, frame, index, adaptive, previous, reference)
+    frame_duration = _frame_duration(cap)
+    adaptive = stride > 1
+
+    metrics = MetricsAccumulator()
+    previous = None
+    reference = None
+    frame_index = 0
+    next_sample = 0
+    dense_until = -1
+    analyzed = 0
+    gaps = np.random.default_rng(0)  # The same samples on every run
+
+    try:
+        while True:
+            if frame_index < next_sample - 1:
+                # Skipped frames are only grabbed, never decoded
+                if not cap.grab():
+                    break
+                frame_index += 1
+                continue
+            if frame_index == next_sample - 1 and frame_index != previous.index:
+                # The frame before a sample is decoded for lip movement
+                ret, reference = cap.read()
+                if not ret:
+                    break
+                frame_index += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            sample = analyze_frame(frame, frame_index, previous, reference)
+            analyzed += 1 if reference is None else 2
+            reference = None
+            metrics.add(sample)
+            if adaptive and previous is not None and _changed(previous, sample):
+                dense_until = frame_index + DENSE_FRAMES
+            previous = sample
+
+            frame_index += 1
+            if frame_index <= dense_until or not tracker.settled:
+                next_sample = frame_index
+            else:
+                next_sample = frame_index - 1 + int(gaps.integers(stride - stride // 2, stride + stride // 2 + 1))
+    finally:
+        cap.release()
+
+    metrics.finish(frame_index)
+    timeline = Timeline.from_builders(1.0 / frame_duration, frame_index, metrics.runs)
+
+    return {
+        'recording_duration': timeline.duration,
+        'eyes_off_screen_duration': timeline.flag_duration('eyes_off_screen'),
+        'lips_moving_duration': timeline.flag_duration('lips_moving'),
+        'face_detector': face_detector,
+        'analyzed_frames': analyzed,
+        'detector_calls': tracker.detector_calls,
+        'timeline': timeline.to_bytes()
+    }
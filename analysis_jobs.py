@@ -0,0 +1,147 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import AnalysisJob, VideoRecording, UserMetrics, RecordingTimeline, QuestionSet
+from timeline import Timeline
+from face_detectors import DEFAULT_FACE_DETECTOR
+
+MAX_ATTEMPTS = 3
+JOB_LEASE_SECONDS = 60 * 60  # A running job older than this is assumed abandoned
+
+
+def enqueue_analysis(session, video_recording):
+    job = AnalysisJob(video_recording_id=video_recording.id, kind='analyze', status='pending')
+    session.add(job)
+    return job
+
+
+def enqueue_transcode(session, video_recording):
+    job = AnalysisJob(video_recording_id=video_recording.id, kind='transcode', status='pending')
+    session.add(job)
+    return job
+
+
+def face_detector_for(session, video):
+    # Face detector backend of the recording's test, or the server default
+    if video.question_set_id is not None:
+        question_set = session.get(QuestionSet, video.question_set_id)
+        if question_set is not None and question_set.face_detector:
+            return question_set.face_detector
+    return DEFAULT_FACE_DETECTOR
+
+
+def queue_depth(session):
+    # Job counts by (kind, status), for monitoring
+    rows = session.query(AnalysisJob.kind, AnalysisJob.status, func.count(AnalysisJob.id)).filter(
+        AnalysisJob.status.in_(('pending', 'running'))
+    ).group_by(AnalysisJob.kind, AnalysisJob.status).all()
+    return {(kind or 'analyze', status): count for kind, status, count in rows}
+
+
+def claim_job(session, worker):
+    # Claim the oldest pending job. The conditional UPDATE makes the claim
+    # safe when several workers poll the same table.
+    while True:
+        job = session.query(AnalysisJob).filter_by(status='pending').order_by(AnalysisJob.id).first()
+        if not job:
+            return None
+
+        claimed = session.query(AnalysisJob).filter_by(id=job.id, status='pending').update({
+            'status': 'running',
+            'worker': worker,
+            'attempts': AnalysisJob.attempts + 1,
+            'started_at': datetime.utcnow()
+        }, synchronize_session=False)
+        session.commit()
+
+        if claimed:
+            session.refresh(job)
+            return job
+
+
+def complete_job(session, job_id, result):
+    job = session.get(AnalysisJob, job_id)
+    video = session.get(VideoRecording, job.video_recording_id)
+
+    replaced_path = None
+    if job.kind == 'transcode':
+        replaced_path = _record_transcode(video, result)
+    else:
+        # A recording has one metrics row. A re-analysis, or a job whose lease
+        # expired mid-run finishing twice, replaces it.
+        metrics = session.query(UserMetrics).filter_by(video_recording_id=video.id).first()
+        if metrics is None:
+            metrics = UserMetrics(user_id=video.user_id, admin_id=video.admin_id, video_recording_id=video.id)
+            session.add(metrics)
+        metrics.recording_duration = result['recording_duration']
+        metrics.eyes_off_screen_duration = result['eyes_off_screen_duration']
+        metrics.lips_moving_duration = result['lips_moving_duration']
+        metrics.face_detector = result.get('face_detector')
+        if result.get('timeline'):
+            timeline = Timeline.from_bytes(result['timeline'])
+            session.merge(RecordingTimeline(
+                video_recording_id=video.id,
+                fps=timeline.fps,
+                frame_count=timeline.frame_count,
+                data=result['timeline']
+            ))
+        # Storage is reduced only after analysis has seen the full
+        # recording, and only once
+        if not session.query(AnalysisJob.id).filter_by(video_recording_id=video.id, kind='transcode').first():
+            enqueue_transcode(session, video)
+    job.status = 'done'
+    job.error = None
+    job.finished_at = datetime.utcnow()
+    session.commit()
+
+    # The original goes only once the new path is committed
+    if replaced_path and os.path.exists(replaced_path):
+        os.remove(replaced_path)
+
+
+def _record_transcode(video, result):
+    # Returns the path of the file the transcode replaced, if any
+    thumbnails = result['thumbnails']
+    replaced_path = video.file_path if result['file_path'] != video.file_path else None
+    video.file_path = result['file_path']
+    video.storage_status = 'transcoded' if replaced_path else 'original'
+    video.storage_profile = result['profile']
+    video.original_size = result['original_size']
+    video.stored_size = result['stored_size']
+    video.thumbnail_path = thumbnails['path']
+    video.thumbnail_size = thumbnails['size']
+    video.thumbnail_count = thumbnails['count']
+    video.thumbnail_interval = thumbnails['interval']
+    video.transcoded_at = datetime.utcnow()
+    return replaced_path
+
+
+def fail_job(session, job_id, error):
+    # Put the job back in the queue until it runs out of attempts
+    job = session.get(AnalysisJob, job_id)
+    job.status = 'pending' if job.attempts < MAX_ATTEMPTS else 'failed'
+    job.error = str(error)[:500]
+    job.finished_at = datetime.utcnow()
+    session.commit()
+
+
+def release_job(session, job_id):
+    # Hand a job back without counting the attempt, e.g. on worker shutdown
+    session.query(AnalysisJob).filter_by(id=job_id, status='running').update({
+        'status': 'pending',
+        'attempts': AnalysisJob.attempts - 1
+    }, synchronize_session=False)
+    session.commit()
+
+
+def requeue_stale_jobs(session, lease_seconds=JOB_LEASE_SECONDS):
+    # Jobs left 'running' by a worker that died are picked up again
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    stale = session.query(AnalysisJob).filter(
+        AnalysisJob.status == 'running', AnalysisJob.started_at < cutoff
+    ).all()
+    for job in stale:
+        job.status = 'pending' if job.attempts < MAX_ATTEMPTS else 'failed'
+        job.error = 'Job lease expired'
+    session.commit()
+    return len(stale)
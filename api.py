@@ -1,69 +1,34 @@
 import os
 import time
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, url_for
 from flask_jwt_extended import JWTManager, create_access_token, current_user, jwt_required, get_jwt_identity
 from models import *
-import cv2
-import threading
-from database import Session
-from werkzeug.security import generate_password_hash, check_password_hash
+from database import db_session, pool_stats
+from grading import SubmissionError
+from attempts import start_attempt, latest_attempt, get_attempt, save_answer, attempt_answers, submit_attempt, is_resubmission, answer_buffer, AttemptError
+from results import question_set_summary
+from question_cache import get_question_set_payload
+from identity_cache import user_cache
+from streaming import send_recording
+from recording_supervisor import supervisor
+from live_analysis import live_service
+from instrumentation import registry
+from pagination import page_args, keyset_page, with_next_cursor, PaginationError
+from question_import import bulk_create_questions, import_questions, iter_questions, decode_lines, QuestionImportError, IMPORT_FORMATS
+from video_profiles import VIDEO_PROFILES
+from face_detectors import FACE_DETECTORS
+from timeline import Timeline, FLAGS as TIMELINE_FLAGS
+from review import video_details_query, video_details, flagged_condition, MAX_BATCH_IDS
+from uploads import open_upload, append_chunk, push_frame, finalize_uploads, current_offset, UploadError, MAX_FRAME_SIZE
+from password_hashing import password_hasher, HashingBusy
 
 auth_bp = Blueprint('auth', __name__)
 admin_bp = Blueprint('admin', __name__)
 user_bp = Blueprint('user', __name__)
+metrics_bp = Blueprint('metrics', __name__)
 
-global video_recording
-video_threads = {}
-frames = []
-frame_rate = 30.0
-frame_size = (640, 480)
-FPS = 30  # Frames per second
-WIDTH = 640  # Video width in pixels
-HEIGHT = 480  # Video height in pixels
-
-def save_video_to_static(video_save_path, frames, frame_rate, frame_size):
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    out = cv2.VideoWriter(video_save_path, fourcc, frame_rate, frame_size)
-
-    if not out.isOpened():
-        return False
-
-    for frame in frames:
-        out.write(frame)
-
-    out.release()
-    return True
-
-def record_video(admin_id, user_id, video_save_path, video_recording):
-    try:
-        # Initialize video capture using OpenCV
-        cap = cv2.VideoCapture(0)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(video_save_path, fourcc, FPS, (WIDTH, HEIGHT))
-
-        while video_recording.get(user_id, False):
-            ret, frame = cap.read()
-            if not ret:
-                break
-            out.write(frame)
-
-        # Release video capture and writer
-        cap.release()
-        out.release()
-
-        # Create an entry in the VideoRecording table
-        with Session() as session:
-            new_video_recording = VideoRecording(
-                user_id=user_id,
-                admin_id=admin_id,
-                file_path=video_save_path
-            )
-            session.add(new_video_recording)
-            session.commit()
-
-    except Exception as e:
-        print('Error:', str(e))
-
+# Scrapers must send this as a bearer token when it is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 @auth_bp.route('/register', methods=['POST'])
 def register():
@@ -79,19 +44,18 @@ def register():
     if role not in ['user', 'admin']:
         return jsonify(message='Invalid role'), 400
 
-    # Hash the password before storing it
-    hashed_password = generate_password_hash(password)
-
+    # Hash the password before storing it, on the hashing pool
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HashingBusy as e:
+        return _hashing_busy(e)
 
-    new_user = User(username=username, password_hash=hashed_password, role=role)
-    with Session() as session:
-        session.add(new_user)
-        session.commit()
+    # The user and, for admins, the admin entry are created in one transaction
+    session = db_session()
+    session.add(User(username=username, password_hash=hashed_password, role=role))
     if role == 'admin':
-        new_admin = Admin(username=username, password_hash=hashed_password)
-        with Session() as session:
-            session.add(new_admin)
-            session.commit()
+        session.add(Admin(username=username, password_hash=hashed_password))
+    session.commit()
 
     return jsonify(message='Registration successful'), 201
 
@@ -105,18 +69,38 @@ def login():
         return jsonify(message='Missing username or password'), 400
 
     # Check if the user exists
-    with Session() as session:
-        user = session.query(User).filter_by(username=username).first()
-        if not user:
-            return jsonify(message='User not found'), 404
+    session = db_session()
+    user = session.query(User).filter_by(username=username).first()
+    if not user:
+        return jsonify(message='User not found'), 404
+    user_id, password_hash = user.id, user.password_hash
+
+    # Don't hold a connection while the hashing pool verifies the password
+    session.close()
+    try:
+        ok, new_hash = password_hasher.verify(password_hash, password)
+    except HashingBusy as e:
+        return _hashing_busy(e)
+
+    if not ok:
+        return jsonify(message='Invalid password'), 401
+
+    if new_hash:
+        # The stored hash used outdated parameters; store the upgraded one
+        session.query(User).filter_by(id=user_id, password_hash=password_hash).update({'password_hash': new_hash})
+        session.query(Admin).filter_by(username=username, password_hash=password_hash).update({'password_hash': new_hash})
+        session.commit()
+
+    # Create an access token
+    access_token = create_access_token(identity=user_id, expires_delta=False)
+    return jsonify(access_token=access_token, message='Login successful'), 200
 
-        # Verify the password
-        if check_password_hash(user.password_hash, password):
-            # Create an access token
-            access_token = create_access_token(identity=user.id, expires_delta=False)
-            return jsonify(access_token=access_token, message='Login successful'), 200
-        else:
-            return jsonify(message='Invalid password'), 401
+
+def _hashing_busy(error):
+    # Hashing is saturated (e.g. everyone logging in at exam start)
+    response = jsonify(message=str(error))
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 
 @admin_bp.route('/tests/create', methods=['POST'])
@@ -129,40 +113,39 @@ def create_test():
         test_name = data.get('test_name')
         questions = data.get('questions')  # List of question objects
 
+        # Optional storage and analysis policy for the test's recordings
+        video_profile = data.get('video_profile')
+        retention_days = data.get('retention_days')
+        face_detector = data.get('face_detector')
+        if video_profile is not None and video_profile not in VIDEO_PROFILES:
+            return jsonify({'message': 'Invalid video_profile', 'profiles': list(VIDEO_PROFILES)}), 400
+        if retention_days is not None and (not isinstance(retention_days, int) or retention_days < 1):
+            return jsonify({'message': 'retention_days must be a positive integer'}), 400
+        if face_detector is not None and face_detector not in FACE_DETECTORS:
+            return jsonify({'message': 'Invalid face_detector', 'face_detectors': list(FACE_DETECTORS)}), 400
+
         # Ensure the admin_id matches the current user's ID
         admin_id = current_user.id
 
-        session = Session()  # Create a session object
+        session = db_session()
 
         try:
             # Create a new QuestionSet
-            new_question_set = QuestionSet(name=test_name, admin_id=admin_id)
+            new_question_set = QuestionSet(name=test_name, admin_id=admin_id,
+                                           video_profile=video_profile, retention_days=retention_days,
+                                           face_detector=face_detector)
             session.add(new_question_set)
             session.flush()  # Flush the session to ensure new_question_set gets an ID
             new_question_set_id = new_question_set.id
 
             # Create questions and options associated with the question set
-            for question_data in questions:
-                question_text = question_data.get('text')
-                options_data = question_data.get('options')  # List of option objects
-
-                new_question = Question(text=question_text, question_set_id=new_question_set_id)
-                session.add(new_question)
-                session.flush()  # Flush the session to ensure new_question gets an ID
-
-                # Create options for the question
-                for option_data in options_data:
-                    option_text = option_data.get('text')
-                    is_correct = option_data.get('is_correct')
-                    new_option = Option(text=option_text, is_correct=is_correct, question_id=new_question.id, created_at=func.now())
-                    session.add(new_option)
+            # with set-based inserts
+            bulk_create_questions(session, new_question_set_id, questions)
 
             session.commit()
         except Exception as e:
             session.rollback()
             return jsonify({'message': 'Failed to create test', 'error': str(e)}), 500
-        finally:
-            session.close()  # Close the session
 
         return jsonify({'message': 'Test created successfully', 'test_id': new_question_set_id}), 201
 
@@ -170,6 +153,34 @@ def create_test():
         return jsonify({'message': 'Failed to create test', 'error': str(e)}), 500
 
 
+# Streams a CSV or JSONL question bank from the request body into a test
+@admin_bp.route('/tests/<int:test_id>/import', methods=['POST'])
+@jwt_required()
+def import_test_questions(test_id):
+    try:
+        admin_id = get_jwt_identity()
+        fmt = request.args.get('format', 'jsonl').lower()
+        if fmt not in IMPORT_FORMATS:
+            return jsonify({'message': f'Unsupported import format {fmt}'}), 400
+
+        session = db_session()
+        test = session.query(QuestionSet).filter_by(admin_id=admin_id, id=test_id).first()
+        if not test:
+            return jsonify({'message': 'Test not found'}), 404
+
+        questions = iter_questions(decode_lines(request.stream), fmt)
+        try:
+            imported = import_questions(session, test_id, questions)
+        except QuestionImportError as e:
+            session.rollback()
+            return jsonify({'message': 'Failed to import questions', 'error': str(e), 'imported': e.imported}), 400
+
+        return jsonify({'message': 'Questions imported successfully', 'test_id': test_id, 'imported': imported}), 201
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to import questions', 'error': str(e)}), 500
+
+
 @admin_bp.route('/tests', methods=['GET'])
 @jwt_required()
 def list_tests():
@@ -177,14 +188,19 @@ def list_tests():
         # Get the current admin's ID from the JWT token
         admin_id = get_jwt_identity()
 
-        # Query the database to fetch the list of tests created by the admin
-        with Session() as session:
-            tests = session.query(QuestionSet).filter_by(admin_id=admin_id).all()
+        try:
+            limit, cursor = page_args()
+        except PaginationError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Query the database to fetch one page of tests created by the admin
+        session = db_session()
+        tests, next_cursor = keyset_page(session.query(QuestionSet).filter_by(admin_id=admin_id), QuestionSet.id, limit, cursor)
 
-            # Convert the retrieved tests into a JSON-friendly format
-            test_list = [{'test_id': test.id, 'test_name': test.name} for test in tests]
+        # Convert the retrieved tests into a JSON-friendly format
+        test_list = [{'test_id': test.id, 'test_name': test.name} for test in tests]
 
-        return jsonify({'tests': test_list}), 200
+        return with_next_cursor(jsonify({'tests': test_list, 'next_cursor': next_cursor}), next_cursor), 200
 
     except Exception as e:
         return jsonify({'message': 'Failed to fetch test list', 'error': str(e)}), 500
@@ -198,42 +214,147 @@ def test_details(test_id):
         admin_id = get_jwt_identity()
 
         # Query the database to fetch details of the specified test
-        with Session() as session:
-            test = session.query(QuestionSet).filter_by(admin_id=admin_id, id=test_id).first()
+        session = db_session()
+        test = session.query(QuestionSet).filter_by(admin_id=admin_id, id=test_id).first()
 
-            if not test:
-                return jsonify({'message': 'Test not found'}), 404
+        if not test:
+            return jsonify({'message': 'Test not found'}), 404
 
-            # Retrieve questions associated with the test
-            questions = session.query(Question).filter_by(question_set_id=test.id).all()
+        # Retrieve questions associated with the test
+        questions = session.query(Question).filter_by(question_set_id=test.id).all()
 
-            # Convert the test and questions into a JSON-friendly format
-            test_details = {
-                'test_id': test.id,
-                'test_name': test.name,
-                'questions': [{'question_id': q.id, 'question_text': q.text} for q in questions]
-            }
+        # Convert the test and questions into a JSON-friendly format
+        test_details = {
+            'test_id': test.id,
+            'test_name': test.name,
+            'video_profile': test.video_profile,
+            'retention_days': test.retention_days,
+            'face_detector': test.face_detector,
+            'questions': [{'question_id': q.id, 'question_text': q.text} for q in questions]
+        }
 
         return jsonify(test_details), 200
 
     except Exception as e:
         return jsonify({'message': 'Failed to fetch test details', 'error': str(e)}), 500
 
+# Score summary of a test: mean, spread, distribution and per-question difficulty
+@admin_bp.route('/tests/<int:test_id>/results', methods=['GET'])
+@jwt_required()
+def test_results(test_id):
+    try:
+        admin_id = get_jwt_identity()
+
+        session = db_session()
+        test = session.query(QuestionSet).filter_by(admin_id=admin_id, id=test_id).first()
+        if not test:
+            return jsonify({'message': 'Test not found'}), 404
+
+        return jsonify(question_set_summary(session, test.id)), 200
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to fetch test results', 'error': str(e)}), 500
+
+# Individual attempts at a test, optionally for one student
+@admin_bp.route('/tests/<int:test_id>/attempts', methods=['GET'])
+@jwt_required()
+def test_attempts(test_id):
+    try:
+        admin_id = get_jwt_identity()
+        try:
+            limit, cursor = page_args()
+        except PaginationError as e:
+            return jsonify({'message': str(e)}), 400
+
+        session = db_session()
+        test = session.query(QuestionSet).filter_by(admin_id=admin_id, id=test_id).first()
+        if not test:
+            return jsonify({'message': 'Test not found'}), 404
+
+        query = session.query(AttemptResult).filter_by(question_set_id=test.id)
+        user_id = request.args.get('user_id', type=int)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        attempts, next_cursor = keyset_page(query, AttemptResult.id, limit, cursor)
+
+        attempt_list = [{
+            'result_id': attempt.id,
+            'user_id': attempt.user_id,
+            'answered': attempt.answered,
+            'correct': attempt.correct,
+            'total_marks': attempt.total_marks,
+            'max_marks': attempt.max_marks,
+            'submitted_at': attempt.submitted_at.isoformat() if attempt.submitted_at else None
+        } for attempt in attempts]
+
+        return with_next_cursor(jsonify({'attempts': attempt_list, 'next_cursor': next_cursor}), next_cursor), 200
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to fetch test attempts', 'error': str(e)}), 500
+
 @admin_bp.route('/videos', methods=['GET'])
 @jwt_required()
 def list_student_videos():
     try:
         admin_id = get_jwt_identity()
-        with Session() as session:
-            student_videos = session.query(VideoRecording).filter_by(admin_id=admin_id).all()
+        try:
+            limit, cursor = page_args()
+        except PaginationError as e:
+            return jsonify({'message': str(e)}), 400
 
-            video_links = [{'video_id': video.id, 'video_link': video.file_path} for video in student_videos]
+        session = db_session()
+        student_videos, next_cursor = keyset_page(session.query(VideoRecording).filter_by(admin_id=admin_id), VideoRecording.id, limit, cursor)
 
-        return jsonify(video_links), 200
+        video_links = [{'video_id': video.id, 'video_link': video.file_path,
+                        'stream_url': url_for('admin.stream_student_video', video_id=video.id)} for video in student_videos]
+
+        return with_next_cursor(jsonify(video_links), next_cursor), 200
 
     except Exception as e:
         return jsonify({'message': 'Failed to fetch student videos', 'error': str(e)}), 500
     
+# Details of many student videos with their metrics in one query, for
+# review dashboards. Filters: ids, test_id, user_id and flagged=1.
+@admin_bp.route('/videos/details', methods=['GET'])
+@jwt_required()
+def student_videos_details():
+    try:
+        admin_id = get_jwt_identity()
+        try:
+            limit, cursor = page_args()
+            ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        except (PaginationError, ValueError):
+            return jsonify({'message': 'Invalid limit, cursor or ids'}), 400
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({'message': f'At most {MAX_BATCH_IDS} ids per request'}), 400
+
+        session = db_session()
+        query = video_details_query(session).filter(VideoRecording.admin_id == admin_id)
+        if ids:
+            query = query.filter(VideoRecording.id.in_(ids))
+        test_id = request.args.get('test_id', type=int)
+        if test_id is not None:
+            query = query.filter(VideoRecording.question_set_id == test_id)
+        user_id = request.args.get('user_id', type=int)
+        if user_id is not None:
+            query = query.filter(VideoRecording.user_id == user_id)
+        if request.args.get('flagged') in ('1', 'true'):
+            query = query.filter(flagged_condition())
+
+        if cursor is not None:
+            query = query.filter(VideoRecording.id > cursor)
+        rows = query.order_by(VideoRecording.id).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1][0].id)
+
+        videos = [video_details(video, metrics, status) for video, metrics, status in rows]
+        return with_next_cursor(jsonify({'videos': videos, 'next_cursor': next_cursor}), next_cursor), 200
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to fetch student video details', 'error': str(e)}), 500
+
 # Student Video Details API
 @admin_bp.route('/videos/<int:video_id>', methods=['GET'])
 @jwt_required()
@@ -241,39 +362,157 @@ def student_video_details(video_id):
     try:
         admin_id = get_jwt_identity()
 
-        with Session() as session:
-            student_video = session.query(VideoRecording).filter_by(admin_id=admin_id, id=video_id).first()
+        # The video, the metrics written for it by the analysis worker and
+        # the analysis status in one query
+        session = db_session()
+        row = video_details_query(session).filter(VideoRecording.admin_id == admin_id, VideoRecording.id == video_id).first()
+
+        if not row:
+            return jsonify({'message': 'Student video not found'}), 404
+
+        return jsonify(video_details(*row)), 200
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to fetch student video details', 'error': str(e)}), 500
+
+# Flagged intervals of a student video, optionally within ?start=&end= seconds
+@admin_bp.route('/videos/<int:video_id>/timeline', methods=['GET'])
+@jwt_required()
+def student_video_timeline(video_id):
+    try:
+        admin_id = get_jwt_identity()
+        try:
+            start = request.args.get('start', 0.0, type=float)
+            end = request.args.get('end', None, type=float)
+            min_duration = request.args.get('min_duration', 0.0, type=float)
+            flags = [f for f in request.args.get('flags', ','.join(TIMELINE_FLAGS)).split(',') if f]
+            if any(f not in TIMELINE_FLAGS for f in flags):
+                raise ValueError
+        except ValueError:
+            return jsonify({'message': 'Invalid start, end, min_duration or flags', 'flags': list(TIMELINE_FLAGS)}), 400
+
+        session = db_session()
+        row = session.query(RecordingTimeline).join(
+            VideoRecording, VideoRecording.id == RecordingTimeline.video_recording_id
+        ).filter(VideoRecording.admin_id == admin_id, VideoRecording.id == video_id).first()
+        if not row:
+            return jsonify({'message': 'Timeline not found'}), 404
+
+        timeline = Timeline.from_bytes(row.data)
+        return jsonify({
+            'video_id': video_id,
+            'duration': timeline.duration,
+            'start': start,
+            'end': timeline.duration if end is None else min(end, timeline.duration),
+            'intervals': {f: timeline.intervals(f, start, end, min_duration).tolist() for f in flags},
+            # Over the whole recording
+            'totals': {f: timeline.flag_duration(f) for f in flags}
+        }), 200
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to fetch video timeline', 'error': str(e)}), 500
 
-            if not student_video:
-                return jsonify({'message': 'Student video not found'}), 404
+# Streams a student video with support for Range and conditional requests
+@admin_bp.route('/videos/<int:video_id>/stream', methods=['GET'])
+@jwt_required()
+def stream_student_video(video_id):
+    try:
+        admin_id = get_jwt_identity()
 
-            # Query and include metrics received from the ML model for the video
-            metrics = session.query(UserMetrics).filter_by(admin_id=admin_id, user_id=student_video.user_id).first()
+        session = db_session()
+        student_video = session.query(VideoRecording).filter_by(admin_id=admin_id, id=video_id).first()
+        if not student_video:
+            return jsonify({'message': 'Student video not found'}), 404
+        file_path = student_video.file_path
 
-            video_details = {
-                'video_id': student_video.id,
-                'video_link': student_video.file_path,
-                'metrics': {
-                    'recording_duration': metrics.recording_duration,
-                    'eyes_off_screen_duration': metrics.eyes_off_screen_duration,
-                    'lips_moving_duration': metrics.lips_moving_duration
-                }
-            }
+        # Don't hold a connection while the file is being sent
+        session.close()
 
-        return jsonify(video_details), 200
+        response = send_recording(file_path)
+        if response is None:
+            return jsonify({'message': 'Video file not found'}), 404
+        return response
 
     except Exception as e:
-        return jsonify({'message': 'Failed to fetch student video details', 'error': str(e)}), 500
+        return jsonify({'message': 'Failed to stream student video', 'error': str(e)}), 500
+
+# Thumbnail strip of a student video for scrubbing
+@admin_bp.route('/videos/<int:video_id>/thumbnails', methods=['GET'])
+@jwt_required()
+def student_video_thumbnails(video_id):
+    try:
+        admin_id = get_jwt_identity()
+
+        session = db_session()
+        student_video = session.query(VideoRecording).filter_by(admin_id=admin_id, id=video_id).first()
+        if not student_video:
+            return jsonify({'message': 'Student video not found'}), 404
+        thumbnail_path = student_video.thumbnail_path
+        session.close()
+
+        response = send_recording(thumbnail_path) if thumbnail_path else None
+        if response is None:
+            return jsonify({'message': 'Thumbnails not available'}), 404
+        return response
+
+    except Exception as e:
+        return jsonify({'message': 'Failed to fetch video thumbnails', 'error': str(e)}), 500
+
+# Active recording sessions on this node
+@admin_bp.route('/system/recordings', methods=['GET'])
+@jwt_required()
+def recording_stats():
+    return jsonify(supervisor.stats()), 200
+
+# Live proctoring flags for the admin's recordings running on this node
+@admin_bp.route('/live/sessions', methods=['GET'])
+@jwt_required()
+def live_sessions():
+    admin_id = get_jwt_identity()
+    return jsonify(sessions=live_service.sessions_for_admin(admin_id), stats=live_service.stats()), 200
+
+# Password hashing pool load, queue wait and hash time
+@admin_bp.route('/system/password-hashing', methods=['GET'])
+@jwt_required()
+def password_hashing_stats():
+    return jsonify(password_hasher.stats()), 200
+
+# Connection pool checkout/wait statistics
+@admin_bp.route('/system/db-pool', methods=['GET'])
+@jwt_required()
+def database_pool_stats():
+    return jsonify(pool_stats()), 200
+
+# Identity cache hit/miss counters, for sizing the cache
+@admin_bp.route('/system/identity-cache', methods=['GET'])
+@jwt_required()
+def identity_cache_stats():
+    return jsonify(user_cache.stats()), 200
+
+@admin_bp.route('/system/autosave', methods=['GET'])
+@jwt_required()
+def autosave_stats():
+    return jsonify(answer_buffer.stats()), 200
 
 @user_bp.route('/question-sets', methods=['GET'])
 @jwt_required()
 def list_question_sets():
     try:
-        with Session() as session:
-            question_sets = session.query(QuestionSet).all()
-            question_sets_data = [{'question_set_id': qs.id, 'name': qs.name} for qs in question_sets]
+        try:
+            limit, cursor = page_args()
+            admin_id = request.args.get('admin_id', type=int)
+        except PaginationError as e:
+            return jsonify({'message': str(e)}), 400
+
+        session = db_session()
+        query = session.query(QuestionSet)
+        if admin_id is not None:
+            # Only one admin's question sets
+            query = query.filter_by(admin_id=admin_id)
+        question_sets, next_cursor = keyset_page(query, QuestionSet.id, limit, cursor)
+        question_sets_data = [{'question_set_id': qs.id, 'name': qs.name} for qs in question_sets]
 
-            return jsonify(question_sets_data), 200
+        return with_next_cursor(jsonify(question_sets_data), next_cursor), 200
 
     except Exception as e:
         return jsonify({'message': 'Failed to fetch question sets', 'error': str(e)}), 500
@@ -283,28 +522,56 @@ def list_question_sets():
 @jwt_required()
 def get_questions_for_question_set(question_set_id):
     try:
-        with Session() as session:
-            question_set = session.query(QuestionSet).filter_by(id=question_set_id).first()
+        session = db_session()
+        # Questions and options are serialized once per question set and
+        # served from the cache until the set changes
+        payload = get_question_set_payload(session, question_set_id)
 
-            # Check if the question set exists
-            if not question_set:
-                return jsonify({'message': 'Question set not found'}), 404
+        # Check if the question set exists
+        if payload is None:
+            return jsonify({'message': 'Question set not found'}), 404
 
-            # Retrieve questions and options associated with the question set
-            questions = session.query(Question).filter_by(question_set_id=question_set.id).all()
-
-            # Serialize the questions and options to JSON
-            questions_data = []
-            for question in questions:
-                options = [{'option_id': option.id, 'text': option.text, 'is_correct': option.is_correct} for option in question.options]
-                question_data = {'question_id': question.id, 'text': question.text, 'options': options}
-                questions_data.append(question_data)
-
-            return jsonify(questions_data), 200
+        response = current_app.response_class(payload.body, mimetype='application/json')
+        response.set_etag(payload.etag)
+        return response.make_conditional(request)
 
     except Exception as e:
         return jsonify({'message': 'Failed to fetch questions for the question set', 'error': str(e)}), 500
     
+def _attempt_json(session, attempt):
+    answers = attempt_answers(session, attempt)
+    data = {
+        'attempt_id': attempt.id,
+        'question_set_id': attempt.question_set_id,
+        'status': attempt.status,
+        'started_at': attempt.started_at.isoformat() if attempt.started_at else None,
+        'submitted_at': attempt.submitted_at.isoformat() if attempt.submitted_at else None,
+        'answers': [{'question_id': q, 'option_id': o} for q, o in sorted(answers.items())]
+    }
+    if attempt.result_id:
+        result = session.get(AttemptResult, attempt.result_id)
+        data['result'] = {'result_id': result.id, 'total_marks': result.total_marks, 'max_marks': result.max_marks}
+    return data
+
+
+def _submit(session, attempt, answers):
+    # Grade the attempt and finalize its recording. A retried submit gets
+    # the stored result back and changes nothing.
+    attempt_id, user_id, question_set_id = attempt.id, attempt.user_id, attempt.question_set_id
+    try:
+        result, submitted = submit_attempt(session, attempt, answers)
+    except SubmissionError as e:
+        return jsonify(message=str(e)), 400
+
+    if submitted:
+        # Finalize the uploaded recording into a VideoRecording entry
+        finalize_uploads(session, user_id, question_set_id)
+    session.commit()
+
+    return jsonify(message='Answers submitted successfully', attempt_id=attempt_id, result_id=result.id,
+                   total_marks=result.total_marks, max_marks=result.max_marks), 200
+
+
 @user_bp.route('/question-sets/<int:question_set_id>/submit-answers', methods=['POST'])
 @jwt_required()
 def submit_answers(question_set_id):
@@ -312,63 +579,114 @@ def submit_answers(question_set_id):
         user_id = get_jwt_identity()
         data = request.json
         answers = data.get('answers')
+        attempt_id = data.get('attempt_id')
 
-        if not answers:
+        # Answers may have been autosaved into an attempt; without one, they
+        # all come with the submit
+        if not answers and not attempt_id:
             return jsonify(message='Missing answers'), 400
 
-        total_marks = 0.0  # Initialize total marks
+        session = db_session()
+        try:
+            if attempt_id:
+                attempt = get_attempt(session, user_id, attempt_id)
+                if attempt.question_set_id != question_set_id:
+                    return jsonify(message='Attempt not found'), 404
+            elif not session.query(QuestionSet.id).filter_by(id=question_set_id).first():
+                return jsonify(message='Question set not found'), 404
+            else:
+                # Without an attempt id the submit belongs to the latest
+                # attempt, so a retried submit returns the stored result
+                # instead of grading a second attempt. Other answers for a
+                # submitted attempt are a retake, which needs a new attempt.
+                attempt = latest_attempt(session, user_id, question_set_id)
+                if attempt is None:
+                    attempt, _ = start_attempt(session, user_id, question_set_id)
+                elif attempt.status == 'submitted' and not is_resubmission(session, attempt, answers):
+                    return jsonify(message='Attempt already submitted; start a new attempt to take the test again',
+                                   attempt_id=attempt.id), 409
+        except AttemptError as e:
+            return jsonify(message=str(e)), e.status_code
+        except SubmissionError as e:
+            return jsonify(message=str(e)), 400
+
+        return _submit(session, attempt, answers)
 
-        # Signal the recording thread to stop (if needed)
-        # video_recording[user_id] = False
+    except Exception as e:
+        return jsonify(message='Failed to submit answers', error=str(e)), 500
 
-        with Session() as session:
-            # Loop through the submitted answers
-            for answer_data in answers:
-                question_id = answer_data.get('question_id')
-                option_id = answer_data.get('option_id')
 
-                if not question_id or not option_id:
-                    return jsonify(message='Missing question_id or option_id'), 400
+@user_bp.route('/question-sets/<int:question_set_id>/attempts', methods=['POST'])
+@jwt_required()
+def start_exam_attempt(question_set_id):
+    try:
+        user_id = get_jwt_identity()
+        session = db_session()
+        if not session.query(QuestionSet.id).filter_by(id=question_set_id).first():
+            return jsonify(message='Question set not found'), 404
 
-                # Validate that the question exists and belongs to the specified question set
-                question = session.query(Question).filter_by(id=question_id, question_set_id=question_set_id).first()
-                if not question:
-                    return jsonify(message=f'Question {question_id} not found in the specified question set'), 400
+        # Resumes the attempt in progress, with its saved answers
+        attempt, created = start_attempt(session, user_id, question_set_id)
+        session.commit()
 
-                # Validate that the option exists and belongs to the specified question
-                option = session.query(Option).filter_by(id=option_id, question_id=question_id).first()
-                if not option:
-                    return jsonify(message=f'Option {option_id} not found for the question'), 400
+        return jsonify(_attempt_json(session, attempt)), 201 if created else 200
+    except Exception as e:
+        return jsonify(message='Failed to start attempt', error=str(e)), 500
 
-                # Calculate and record the user's answer and marks obtained
-                is_correct = option.is_correct
-                marks_obtained = 1.0 if is_correct else 0.0
-                total_marks += marks_obtained
 
-                user_answer = UserAnswer(
-                    user_id=user_id,
-                    question_id=question_id,
-                    option_id=option_id,
-                    is_correct=is_correct,
-                    marks_obtained=marks_obtained
-                )
-                session.add(user_answer)
+@user_bp.route('/attempts/<int:attempt_id>', methods=['GET'])
+@jwt_required()
+def exam_attempt_details(attempt_id):
+    try:
+        user_id = get_jwt_identity()
+        session = db_session()
+        try:
+            attempt = get_attempt(session, user_id, attempt_id)
+        except AttemptError as e:
+            return jsonify(message=str(e)), e.status_code
 
-            # Stop video recording (if needed)
-            # video_thread = video_threads.get(user_id)
-            # if video_thread:
-            #     video_thread.join()
+        return jsonify(_attempt_json(session, attempt)), 200
+    except Exception as e:
+        return jsonify(message='Failed to fetch attempt', error=str(e)), 500
 
-            # Save the recorded video to the static folder
-            video_save_path = f'static/{user_id}_test_{question_set_id}.avi'  # Set the video save path
-            save_video_to_static(video_save_path, frames, frame_rate, frame_size)
 
-            # Remove the video recording status entry for the user (if needed)
-            # del video_recording[user_id]
+@user_bp.route('/attempts/<int:attempt_id>/answers/<int:question_id>', methods=['PUT'])
+@jwt_required()
+def autosave_answer(attempt_id, question_id):
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+
+        session = db_session()
+        # Checked against the cached answer key, then written in one batch
+        # with the answers other students saved at the same time
+        try:
+            attempt = get_attempt(session, user_id, attempt_id)
+            save_answer(session, attempt, question_id, data.get('option_id'))
+        except AttemptError as e:
+            return jsonify(message=str(e)), e.status_code
+        except SubmissionError as e:
+            return jsonify(message=str(e)), 400
+
+        return jsonify(message='Answer saved', attempt_id=attempt_id, question_id=question_id), 200
+    except Exception as e:
+        return jsonify(message='Failed to save answer', error=str(e)), 500
 
-            session.commit()
 
-        return jsonify(message='Answers submitted successfully', total_marks=total_marks), 200
+@user_bp.route('/attempts/<int:attempt_id>/submit', methods=['POST'])
+@jwt_required()
+def submit_exam_attempt(attempt_id):
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+
+        session = db_session()
+        try:
+            attempt = get_attempt(session, user_id, attempt_id)
+        except AttemptError as e:
+            return jsonify(message=str(e)), e.status_code
+
+        return _submit(session, attempt, data.get('answers'))
 
     except Exception as e:
         return jsonify(message='Failed to submit answers', error=str(e)), 500
@@ -377,26 +695,109 @@ def submit_answers(question_set_id):
 @user_bp.route('/question-sets/<int:question_set_id>/start-recording', methods=['POST'])
 @jwt_required()
 def start_recording(question_set_id):
-    global video_recording  # Define video_recording as a global variable
     try:
         user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        extension = data.get('format', 'webm').lower()
+        # 'frames' uploads send individual images that the server encodes
+        mode = 'frames' if extension == 'frames' else 'chunks'
 
-        # Retrieve the admin_id associated with the question set
-        with Session() as session:
-            question_set = session.query(QuestionSet).filter_by(id=question_set_id).first()
-            if not question_set:
-                return jsonify(message='Question set not found'), 404
+        session = db_session()
+        question_set = session.query(QuestionSet).filter_by(id=question_set_id).first()
+        if not question_set:
+            return jsonify(message='Question set not found'), 404
 
-            admin_id = question_set.admin_id
-
-        # Set the user's recording status to True
-        video_recording[user_id] = True
+        # Open (or resume) an upload the client streams the recording into
+        try:
+            upload = open_upload(session, user_id, question_set, extension=f'.{extension}', mode=mode)
+        except UploadError as e:
+            return jsonify(message=str(e)), e.status_code
+        session.commit()
 
-        # Start video recording in a separate thread
-        video_save_path = f'static/{user_id}_test_{question_set_id}.avi'  # Set the video save path
-        video_thread = threading.Thread(target=record_video, args=(admin_id, user_id, video_save_path))
-        video_thread.start()
+        upload_id = upload.id
+        offset = current_offset(upload)
 
-        return jsonify(message='Live recording started'), 200
+        return jsonify(message='Live recording started', upload_id=upload_id, mode=mode, offset=offset), 200
     except Exception as e:
         return jsonify(message='Failed to start recording', error=str(e)), 500
+
+
+@user_bp.route('/recordings/<upload_id>', methods=['GET'])
+@jwt_required()
+def recording_upload_status(upload_id):
+    try:
+        user_id = get_jwt_identity()
+        session = db_session()
+        upload = session.query(VideoUpload).filter_by(id=upload_id, user_id=user_id).first()
+        if not upload:
+            return jsonify(message='Upload not found'), 404
+
+        return jsonify(upload_id=upload.id, status=upload.status, offset=current_offset(upload)), 200
+    except Exception as e:
+        return jsonify(message='Failed to fetch upload status', error=str(e)), 500
+
+
+@user_bp.route('/recordings/<upload_id>', methods=['PATCH'])
+@jwt_required()
+def upload_recording_chunk(upload_id):
+    try:
+        user_id = get_jwt_identity()
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None:
+            return jsonify(message='Missing Upload-Offset header'), 400
+
+        session = db_session()
+        upload = session.query(VideoUpload).filter_by(id=upload_id, user_id=user_id).first()
+        if not upload:
+            return jsonify(message='Upload not found'), 404
+
+        # Give the connection back to the pool while the chunk streams in
+        session.close()
+
+        # The chunk is copied from the request stream to disk without buffering it
+        try:
+            new_offset = append_chunk(upload, offset, request.stream, request.content_length)
+        except UploadError as e:
+            return jsonify(message=str(e), offset=e.offset), e.status_code
+
+        return jsonify(upload_id=upload_id, offset=new_offset), 200
+    except Exception as e:
+        return jsonify(message='Failed to upload recording chunk', error=str(e)), 500
+
+
+@user_bp.route('/recordings/<upload_id>/frames', methods=['POST'])
+@jwt_required()
+def upload_recording_frame(upload_id):
+    try:
+        user_id = get_jwt_identity()
+
+        session = db_session()
+        upload = session.query(VideoUpload).filter_by(id=upload_id, user_id=user_id).first()
+        if not upload:
+            return jsonify(message='Upload not found'), 404
+        session.close()
+
+        # One JPEG/PNG frame per request, queued for the session's writer
+        if request.content_length and request.content_length > MAX_FRAME_SIZE:
+            return jsonify(message='Missing or oversized frame'), 413
+        try:
+            frames = push_frame(upload, request.get_data())
+        except UploadError as e:
+            response = jsonify(message=str(e))
+            if e.status_code == 503:
+                # The writer is behind; ask the client to slow down
+                response.headers['Retry-After'] = '1'
+            return response, e.status_code
+
+        # Latest live proctoring flags ride along with each frame response
+        return jsonify(upload_id=upload_id, frames=frames, flags=live_service.flags(upload_id)), 200
+    except Exception as e:
+        return jsonify(message='Failed to upload recording frame', error=str(e)), 500
+
+
+# Prometheus text exposition of request, database and pipeline metrics
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify(message='Unauthorized'), 401
+    return current_app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,32 +1,94 @@
 import os
+import atexit
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from api import *
-from models import Base, engine
+from models import Base, engine, create_schema
+from database import db_session, Session, pool_stats, init_app as init_db
+from identity_cache import load_user
+from recording_supervisor import supervisor
+from uploads import reap_abandoned_uploads
+from live_analysis import live_service, LIVE_ANALYSIS_ENABLED
+from analysis_jobs import queue_depth
+from instrumentation import init_app as init_instrumentation, instrument_engine, register_gauge, registry, Histogram
+from password_hashing import password_hasher
+from attempts import answer_buffer
 
 base_url = os.path.abspath(os.path.dirname(__file__))
-app = Flask(__name__)
+# Recordings are written to the static folder, so it must not be served
+# publicly; admins stream them through /admin/videos/<id>/stream
+app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
-app.config['static_url_path'] = '/static'
-app.config['static_folder'] = ''
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+app.config['VIDEO_ACCEL_REDIRECT_PREFIX'] = os.environ.get('VIDEO_ACCEL_REDIRECT_PREFIX')
 jwt = JWTManager(app)
 jwt.init_app(app)
+init_db(app)
+init_instrumentation(app)
+instrument_engine(engine)
+
+# Finalize abandoned recordings in the background, and flush the open ones
+# when the process exits
+supervisor.start_reaper(reap_abandoned_uploads)
+atexit.register(supervisor.shutdown)
+atexit.register(password_hasher.shutdown)
+# Autosaved answers still waiting for their batch are written before the process exits
+atexit.register(answer_buffer.shutdown)
+
+# Real-time flags need MediaPipe in the API process, so they are opt-in
+if LIVE_ANALYSIS_ENABLED:
+    live_service.start()
+    atexit.register(live_service.shutdown)
 
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(admin_bp, url_prefix='/admin')
 app.register_blueprint(user_bp, url_prefix='/user')
+app.register_blueprint(metrics_bp)
+
+
+password_hash_wait = registry.add(Histogram(
+    'password_hash_queue_wait_seconds', 'Time password checks waited for a hashing process', ('operation',)))
+password_hash_time = registry.add(Histogram(
+    'password_hash_seconds', 'Time spent hashing or verifying a password', ('operation',)))
+
+
+def _observe_password_hash(operation, queue_wait, hash_time):
+    password_hash_wait.observe((operation,), queue_wait)
+    password_hash_time.observe((operation,), hash_time)
+
+
+password_hasher.observers.append(_observe_password_hash)
+
+
+def _analysis_queue_depth():
+    with Session() as session:
+        return queue_depth(session)
+
+
+register_gauge('proctoring_active_recordings', 'Server-encoded recordings running on this node',
+               lambda: supervisor.stats()['active'])
+register_gauge('proctoring_buffered_frames', 'Frames waiting to be encoded on this node',
+               lambda: supervisor.stats()['pending_frames'])
+register_gauge('proctoring_live_sessions', 'Recordings with live analysis on this node',
+               lambda: live_service.stats()['active_sessions'])
+register_gauge('proctoring_analysis_jobs', 'Queued and running analysis and transcode jobs',
+               _analysis_queue_depth, ('kind', 'status'))
+register_gauge('proctoring_autosave_pending', 'Autosaved answers waiting for their batch',
+               lambda: answer_buffer.stats()['pending'])
+register_gauge('password_hash_in_flight', 'Password hashes queued or running',
+               lambda: password_hasher.stats()['in_flight'])
+register_gauge('db_pool_checked_out', 'Database connections in use',
+               lambda: pool_stats().get('checked_out', 0))
 
 
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
     user_id = jwt_data["sub"]
-    with Session() as session:
-        user = session.query(User).filter_by(id=user_id).first()
-    
-    return user
+    # Served from the in-process identity cache; a miss costs one query
+    return load_user(db_session(), user_id)
 
 if __name__ == '__main__':
     with app.app_context():
-        Base.metadata.create_all(engine)
+        create_schema(engine)
     
     app.run(debug=True)
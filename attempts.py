@@ -0,0 +1,318 @@
+import os
+import threading
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select, insert, update, bindparam, tuple_
+from sqlalchemy.exc import IntegrityError
+from database import Session
+from models import ExamAttempt, AttemptAnswer, AttemptResult
+from grading import get_answer_key, parse_answers, check_answers, grade_attempt
+from instrumentation import record_error
+
+# Autosaved answers are written in batches, each as soon as the previous one
+# is committed; a save returns once its batch is. Large batches are written
+# AUTOSAVE_BATCH_SIZE answers per statement.
+AUTOSAVE_BATCH_SIZE = int(os.environ.get('AUTOSAVE_BATCH_SIZE', 500))
+# Beyond this many waiting answers, saves write the backlog themselves
+AUTOSAVE_MAX_PENDING = int(os.environ.get('AUTOSAVE_MAX_PENDING', 50000))
+# A save waiting longer than this for its batch fails, and the client retries
+AUTOSAVE_TIMEOUT = float(os.environ.get('AUTOSAVE_TIMEOUT', 30))
+
+
+class AttemptError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def start_attempt(session, user_id, question_set_id):
+    # Returns (attempt, created). An attempt in progress is resumed; two
+    # requests racing to start one end up with the same attempt, because the
+    # loser's insert fails the unique index and it looks again.
+    for _ in range(3):
+        attempt = session.query(ExamAttempt).filter_by(user_id=user_id, question_set_id=question_set_id, active=1).first()
+        if attempt:
+            return attempt, False
+        try:
+            with session.begin_nested():
+                attempt = ExamAttempt(user_id=user_id, question_set_id=question_set_id, status='in_progress', active=1)
+                session.add(attempt)
+            return attempt, True
+        except IntegrityError:
+            continue
+    raise RuntimeError('Could not start attempt')
+
+
+def latest_attempt(session, user_id, question_set_id):
+    # The user's most recent attempt at a question set: the one in progress
+    # if there is one, since a new attempt can only start once the previous
+    # one is submitted. None if the user never started one.
+    return session.query(ExamAttempt).filter_by(
+        user_id=user_id, question_set_id=question_set_id
+    ).order_by(ExamAttempt.id.desc()).first()
+
+
+def get_attempt(session, user_id, attempt_id):
+    attempt = session.query(ExamAttempt).filter_by(id=attempt_id, user_id=user_id).first()
+    if not attempt:
+        raise AttemptError('Attempt not found', 404)
+    return attempt
+
+
+def write_answers(session, entries):
+    # Upsert {(attempt_id, question_id): (option_id, saved_at)} into
+    # attempt_answers. Writing the same answer twice changes nothing, an
+    # older save never replaces a newer one, and attempts that are no longer
+    # in progress are skipped. Returns the set of keys written.
+    if not entries:
+        return set()
+
+    table = AttemptAnswer.__table__
+    for _ in range(3):
+        try:
+            # The check and the writes share the savepoint's transaction,
+            # which holds the write lock from its start on SQLite, and the
+            # attempt rows are locked on databases that support it, so a
+            # concurrent submit either commits before the check or waits
+            # until these answers are committed
+            with session.begin_nested():
+                open_ids = set(session.execute(
+                    select(ExamAttempt.id)
+                    .where(ExamAttempt.id.in_({a for a, _ in entries}), ExamAttempt.active == 1)
+                    .with_for_update()
+                ).scalars())
+                keys = [key for key in entries if key[0] in open_ids]
+                if not keys:
+                    return set()
+                existing = set(session.execute(
+                    select(AttemptAnswer.attempt_id, AttemptAnswer.question_id)
+                    .where(tuple_(AttemptAnswer.attempt_id, AttemptAnswer.question_id).in_(keys))
+                ).all())
+                new = [
+                    {'attempt_id': a, 'question_id': q, 'option_id': entries[(a, q)][0], 'saved_at': entries[(a, q)][1]}
+                    for a, q in keys if (a, q) not in existing
+                ]
+                changed = [
+                    {'b_attempt_id': a, 'b_question_id': q, 'b_option_id': entries[(a, q)][0], 'b_saved_at': entries[(a, q)][1]}
+                    for a, q in keys if (a, q) in existing
+                ]
+                if new:
+                    session.execute(insert(AttemptAnswer), new)
+                if changed:
+                    session.connection().execute(
+                        table.update()
+                        .where(table.c.attempt_id == bindparam('b_attempt_id'),
+                               table.c.question_id == bindparam('b_question_id'),
+                               table.c.saved_at <= bindparam('b_saved_at'))
+                        .values(option_id=bindparam('b_option_id'), saved_at=bindparam('b_saved_at')),
+                        changed
+                    )
+            return set(keys)
+        except IntegrityError:
+            # Another process inserted one of the new answers first
+            continue
+    raise RuntimeError('Could not save answers')
+
+
+class _Batch:
+    def __init__(self):
+        self.entries = {}  # (attempt_id, question_id) -> (option_id, saved_at)
+        self.written = set()
+        self.error = None
+        self.done = threading.Event()
+
+
+class AnswerBuffer:
+    # Group commit for autosaved answers. A background thread writes the
+    # saves that arrived while the previous batch was being written in one
+    # transaction, and repeated saves of a question in the same batch keep
+    # the latest choice. Under load, many students' answers share a commit;
+    # when idle, a save is written right away. A save returns only once its
+    # batch is committed, so every acknowledged answer is in the database
+    # whichever server process handles the submit.
+    def __init__(self, batch_size=AUTOSAVE_BATCH_SIZE, max_pending=AUTOSAVE_MAX_PENDING, timeout=AUTOSAVE_TIMEOUT):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._batch = _Batch()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Held while a batch is written
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.saved = 0
+        self.coalesced = 0
+        self.written = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    @property
+    def pending(self):
+        return len(self._batch.entries)
+
+    def _start(self):
+        # Started on first use, so each server worker process gets its own
+        # thread after the server has forked it
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='answer-autosave', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                record_error('autosave', e)
+
+    def save(self, attempt_id, question_id, option_id):
+        # Raises AttemptError if the attempt was submitted before the batch
+        # was written, and the write error if the batch failed
+        if self.pending >= self.max_pending:
+            # The database is falling behind; make the caller wait for it
+            self.flush()
+        key = (attempt_id, question_id)
+        with self._lock:
+            self._start()
+            batch = self._batch
+            if key in batch.entries:
+                self.coalesced += 1
+            batch.entries[key] = (option_id, datetime.utcnow())
+            self.saved += 1
+        self._wake.set()
+
+        if not batch.done.wait(self.timeout):
+            raise RuntimeError('Timed out waiting for the answer to be saved')
+        if batch.error is not None:
+            raise batch.error
+        if key not in batch.written:
+            raise AttemptError('Attempt already submitted', 409)
+
+    def flush(self):
+        # Write the answers saved so far; returns the number written
+        with self._flush_lock:
+            with self._lock:
+                batch, self._batch = self._batch, _Batch()
+            if not batch.entries:
+                batch.done.set()
+                return 0
+
+            keys = list(batch.entries)
+            try:
+                with Session() as session:
+                    for i in range(0, len(keys), self.batch_size):
+                        batch.written |= write_answers(session, {key: batch.entries[key] for key in keys[i:i + self.batch_size]})
+                    session.commit()
+            except Exception as e:
+                batch.error = e
+                with self._lock:
+                    self.failed_batches += 1
+                raise
+            finally:
+                batch.done.set()
+
+            with self._lock:
+                self.batches += 1
+                self.written += len(batch.written)
+                self.rejected += len(batch.entries) - len(batch.written)
+            return len(batch.written)
+
+    def shutdown(self):
+        # Write whatever is still waiting before the process exits
+        self._stopping.set()
+        self._wake.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'saved': self.saved,
+                'coalesced': self.coalesced,
+                'written': self.written,
+                'rejected': self.rejected,
+                'batches': self.batches,
+                'failed_batches': self.failed_batches,
+                'batch_size': self.batch_size
+            }
+
+
+answer_buffer = AnswerBuffer()
+
+
+def save_answer(session, attempt, question_id, option_id):
+    # Check the answer against the cached answer key and save it with the
+    # next batch. The session's connection goes back to the pool while the
+    # answer waits for its batch.
+    if attempt.status != 'in_progress':
+        raise AttemptError('Attempt already submitted', 409)
+    key = get_answer_key(session, attempt.question_set_id)
+    question_ids, option_ids = parse_answers([{'question_id': question_id, 'option_id': option_id}])
+    check_answers(key, question_ids, option_ids)
+    attempt_id = attempt.id
+    session.close()
+    answer_buffer.save(attempt_id, int(question_ids[0]), int(option_ids[0]))
+
+
+def attempt_answers(session, attempt):
+    # Saved answers of an attempt
+    return dict(session.execute(
+        select(AttemptAnswer.question_id, AttemptAnswer.option_id).where(AttemptAnswer.attempt_id == attempt.id)
+    ).all())
+
+
+def is_resubmission(session, attempt, answers):
+    # Whether answers sent again to a submitted attempt are ones it was
+    # graded with, as when a client retries a submit. Raises
+    # SubmissionError for invalid answers.
+    question_ids, option_ids = parse_answers(answers)
+    check_answers(get_answer_key(session, attempt.question_set_id), question_ids, option_ids)
+    stored = attempt_answers(session, attempt)
+    return all(stored.get(q) == o for q, o in zip(question_ids.tolist(), option_ids.tolist()))
+
+
+def submit_attempt(session, attempt, answers=None):
+    # Finalize an attempt: write any answers sent with the submit, then
+    # grade what is stored. Returns (result, submitted);
+    # submitting an attempt again returns its existing result. Raises
+    # SubmissionError for invalid answers. The caller commits.
+    if attempt.status == 'submitted':
+        return session.get(AttemptResult, attempt.result_id), False
+
+    entries = {}
+    if answers:
+        question_ids, option_ids = parse_answers(answers)
+        check_answers(get_answer_key(session, attempt.question_set_id), question_ids, option_ids)
+        saved_at = datetime.utcnow()
+        entries = {(attempt.id, q): (o, saved_at) for q, o in zip(question_ids.tolist(), option_ids.tolist())}
+
+    # Autosaves are committed before they are acknowledged, so only the
+    # answers sent with the submit need writing. A save still waiting for
+    # its batch lands before the claim below or is rejected.
+    write_answers(session, entries)
+
+    # Of two racing submits only one moves the attempt out of progress;
+    # the other rolls back and returns the winner's result
+    claimed = session.execute(
+        update(ExamAttempt)
+        .where(ExamAttempt.id == attempt.id, ExamAttempt.status == 'in_progress')
+        .values(status='submitted', active=None, submitted_at=datetime.utcnow())
+    ).rowcount
+    if not claimed:
+        # The attempt may have been inserted by this session, which
+        # leaves the object detached after the rollback, so load it again
+        attempt_id = attempt.id
+        session.rollback()
+        attempt = session.get(ExamAttempt, attempt_id)
+        return session.get(AttemptResult, attempt.result_id), False
+
+    rows = session.execute(
+        select(AttemptAnswer.question_id, AttemptAnswer.option_id).where(AttemptAnswer.attempt_id == attempt.id)
+    ).all()
+    question_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    option_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    result = grade_attempt(session, attempt, question_ids, option_ids)
+    attempt.result_id = result.id
+    return result, True
@@ -0,0 +1,490 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+# Offline benchmarks for the API and the video pipeline. Everything runs
+# against a freshly seeded database in a temporary directory unless
+# --database-url points somewhere else, and results are written as JSON so
+# runs can be compared with --compare.
+
+PASSWORD = 'benchmark'
+PERCENTILES = (50, 95, 99)
+ENDPOINTS = ('login', 'list_question_sets', 'get_questions', 'get_questions_cached', 'autosave_answer', 'submit_answers',
+             'list_tests', 'test_results', 'video_details')
+# Startup is measured per process type by importing its entry module in a
+# fresh interpreter. An API process loads OpenCV once it encodes its first
+# server-side recording, which 'api_recording' stands for.
+STARTUP_PROCESSES = {
+    'api': ['app'],
+    'api_recording': ['app', 'cv2'],
+    'worker': ['worker']
+}
+HEAVY_MODULES = ('cv2', 'mediapipe')
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+elapsed = time.perf_counter() - start
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+except OSError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(json.dumps({'import_seconds': elapsed, 'rss_bytes': rss, 'modules': len(sys.modules),
+                  'heavy_modules': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+class TestClient:
+    # Drives the app in-process through Flask's test client
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.headers
+
+
+class HttpClient:
+    # Drives a running server over HTTP
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers
+
+
+def seed(args, run_id):
+    # Bulk-load users, tests and past submissions. Every user shares one
+    # password hash so seeding doesn't pay the hashing cost per user.
+    from sqlalchemy import insert, select
+    from password_hashing import password_hasher
+    from database import Session
+    from models import User, Admin, QuestionSet, Question, Option
+    from question_import import bulk_create_questions
+    from attempts import start_attempt, submit_attempt
+
+    rng = random.Random(args.seed)
+    password_hash = password_hasher.hash(PASSWORD)
+    admin_name = f'bench_{run_id}_admin'
+    usernames = [f'bench_{run_id}_user{i}' for i in range(args.users)]
+
+    with Session() as session:
+        session.execute(insert(User), [{'username': admin_name, 'password_hash': password_hash, 'role': 'admin'}])
+        session.execute(insert(Admin), [{'username': admin_name, 'password_hash': password_hash}])
+        session.execute(insert(User), [{'username': u, 'password_hash': password_hash, 'role': 'user'} for u in usernames])
+        admin_id = session.execute(select(User.id).where(User.username == admin_name)).scalar_one()
+        user_ids = session.execute(select(User.id).where(User.username.in_(usernames))).scalars().all()
+
+        tests = {}
+        for t in range(args.tests):
+            question_set = QuestionSet(name=f'bench_{run_id}_test{t}', admin_id=admin_id)
+            session.add(question_set)
+            session.flush()
+            bulk_create_questions(session, question_set.id, [
+                {'text': f'Question {q}', 'options': [
+                    {'text': f'Option {o}', 'is_correct': o == 0} for o in range(args.options)
+                ]}
+                for q in range(args.questions)
+            ])
+            session.flush()
+            rows = session.execute(
+                select(Question.id, Option.id).join(Option, Option.question_id == Question.id)
+                .where(Question.question_set_id == question_set.id).order_by(Question.id, Option.id)
+            ).all()
+            questions = {}
+            for question_id, option_id in rows:
+                questions.setdefault(question_id, []).append(option_id)
+            tests[question_set.id] = questions
+        session.commit()
+
+        test_ids = list(tests)
+        for n in range(args.answers):
+            test_id = rng.choice(test_ids)
+            attempt, _ = start_attempt(session, rng.choice(user_ids), test_id)
+            submit_attempt(session, attempt, random_answers(rng, tests[test_id]))
+            if n % 100 == 99:
+                session.commit()
+        session.commit()
+
+        # Open attempts for the users that send the measured requests, so
+        # autosaves have somewhere to go
+        login_ids = dict(session.execute(
+            select(User.username, User.id).where(User.username.in_(usernames[:args.login_users]))
+        ).all())
+        attempts = [
+            {test_id: start_attempt(session, login_ids[u], test_id)[0].id for test_id in test_ids}
+            for u in usernames[:args.login_users]
+        ]
+        session.commit()
+
+    return admin_name, usernames, tests, attempts
+
+
+def random_answers(rng, questions):
+    return [{'question_id': q, 'option_id': rng.choice(options)} for q, options in questions.items()]
+
+
+def get_token(client, username):
+    if isinstance(client, TestClient):
+        response = client.client.post('/auth/login', json={'username': username, 'password': PASSWORD})
+        if response.status_code != 200:
+            raise RuntimeError(f'Login as {username} failed with {response.status_code}')
+        return response.json['access_token']
+    req = urllib.request.Request(client.base_url + '/auth/login', method='POST',
+                                 data=json.dumps({'username': username, 'password': PASSWORD}).encode(),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())['access_token']
+
+
+def build_scenarios(make_client, admin_name, usernames, tests, attempts, args):
+    # Each scenario returns (method, path, body, headers, expected statuses)
+    # for one request; rng and tokens are per thread.
+    from database import Session
+    from models import ExamAttempt
+    from attempts import start_attempt
+
+    setup = make_client()
+    admin_headers = {'Authorization': 'Bearer ' + get_token(setup, admin_name)}
+    user_headers = [{'Authorization': 'Bearer ' + get_token(setup, u)} for u in usernames[:args.login_users]]
+    test_ids = list(tests)
+
+    etags = {}
+    for test_id in test_ids:
+        status, headers = setup.request('GET', f'/user/question-sets/{test_id}/questions', headers=user_headers[0])
+        etags[test_id] = headers.get('ETag')
+
+    def user(rng):
+        return rng.choice(user_headers)
+
+    def get_questions_cached(rng):
+        test_id = rng.choice(test_ids)
+        return 'GET', f'/user/question-sets/{test_id}/questions', None, {**user(rng), 'If-None-Match': etags[test_id]}, (304,)
+
+    def autosave_answer(rng):
+        i = rng.randrange(len(user_headers))
+        test_id = rng.choice(test_ids)
+        question_id, options = rng.choice(list(tests[test_id].items()))
+        path = f'/user/attempts/{attempts[i][test_id]}/answers/{question_id}'
+        return 'PUT', path, {'option_id': rng.choice(options)}, user_headers[i], (200,)
+
+    with Session() as session:
+        user_ids = [session.get(ExamAttempt, next(iter(a.values()))).user_id for a in attempts]
+
+    def submit_answers(rng):
+        # A submitted attempt answers retries with its stored result, so
+        # every request gets a fresh attempt, started in the database before
+        # the timer runs
+        i = rng.randrange(len(user_headers))
+        test_id = rng.choice(test_ids)
+        with Session() as session:
+            attempt, _ = start_attempt(session, user_ids[i], test_id)
+            session.commit()
+            attempt_id = attempt.id
+        body = {'attempt_id': attempt_id, 'answers': random_answers(rng, tests[test_id])}
+        return 'POST', f'/user/question-sets/{test_id}/submit-answers', body, user_headers[i], (200,)
+
+    return {
+        'login': lambda rng: ('POST', '/auth/login', {'username': rng.choice(usernames), 'password': PASSWORD}, {}, (200,)),
+        'list_question_sets': lambda rng: ('GET', '/user/question-sets', None, user(rng), (200,)),
+        'get_questions': lambda rng: ('GET', f'/user/question-sets/{rng.choice(test_ids)}/questions', None, user(rng), (200,)),
+        'get_questions_cached': get_questions_cached,
+        'autosave_answer': autosave_answer,
+        'submit_answers': submit_answers,
+        'list_tests': lambda rng: ('GET', '/admin/tests', None, admin_headers, (200,)),
+        'test_results': lambda rng: ('GET', f'/admin/tests/{rng.choice(test_ids)}/results', None, admin_headers, (200,)),
+        'video_details': lambda rng: ('GET', '/admin/videos/details', None, admin_headers, (200,))
+    }
+
+
+def latency_stats(latencies, errors, wall_time):
+    latencies = np.asarray(latencies) * 1000
+    stats = {'requests': len(latencies), 'errors': errors, 'throughput_rps': len(latencies) / wall_time if wall_time else 0.0,
+             'mean_ms': float(latencies.mean()) if len(latencies) else None}
+    for p in PERCENTILES:
+        stats[f'p{p}_ms'] = float(np.percentile(latencies, p)) if len(latencies) else None
+    return stats
+
+
+def run_endpoint(make_client, scenario, args, seed):
+    local = threading.local()
+    thread_numbers = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, 'client'):
+            local.client = make_client()
+            local.rng = random.Random(seed * 1000003 + next(thread_numbers))
+        method, path, body, headers, expected = scenario(local.rng)
+        start = time.perf_counter()
+        status, _ = local.client.request(method, path, body, headers)
+        elapsed = time.perf_counter() - start
+        with lock:
+            if i >= args.warmup:
+                latencies.append(elapsed)
+            if status not in expected:
+                errors.append(status)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        # Warmup requests go first and aren't timed
+        list(pool.map(one, range(args.warmup)))
+        start = time.perf_counter()
+        list(pool.map(one, range(args.warmup, args.warmup + args.requests)))
+        wall_time = time.perf_counter() - start
+
+    return latency_stats(latencies, len(errors), wall_time)
+
+
+def generate_video(path, seconds, fps=30, size=(640, 480), seed=0):
+    # A synthetic head moving across a noisy background, with blinking eyes
+    # and an opening mouth, so decoders and the analysis loop see motion
+    import cv2
+    rng = np.random.default_rng(seed)
+    background = rng.integers(60, 120, (size[1], size[0], 3), dtype=np.uint8)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'XVID'), fps, size)
+    for i in range(int(seconds * fps)):
+        frame = background.copy()
+        cx = int(size[0] / 2 + size[0] / 6 * np.sin(i / fps))
+        cy = int(size[1] / 2 + size[1] / 12 * np.cos(i / (2 * fps)))
+        cv2.ellipse(frame, (cx, cy), (90, 120), 0, 0, 360, (140, 170, 210), -1)
+        eye = 2 if (i // 15) % 10 == 0 else 10
+        cv2.ellipse(frame, (cx - 35, cy - 30), (14, eye), 0, 0, 360, (40, 40, 40), -1)
+        cv2.ellipse(frame, (cx + 35, cy - 30), (14, eye), 0, 0, 360, (40, 40, 40), -1)
+        cv2.ellipse(frame, (cx, cy + 55), (30, 4 + 10 * ((i // 8) % 2)), 0, 0, 360, (60, 50, 150), -1)
+        out.write(frame)
+    out.release()
+    return int(seconds * fps)
+
+
+def run_video(args, workdir):
+    import cv2
+    from transcode import transcode_recording
+
+    path = os.path.join(workdir, 'synthetic.avi')
+    frames = generate_video(path, args.video_seconds, seed=args.seed)
+    results = {'frames': frames, 'seconds': args.video_seconds}
+
+    start = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    while cap.read()[0]:
+        pass
+    cap.release()
+    results['decode_fps'] = frames / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    transcode_recording(path, 'standard')
+    results['transcode_fps'] = frames / (time.perf_counter() - start)
+
+    from analysis import analyze_video
+    from face_detectors import create_detector, DetectorUnavailable
+    results['analysis'] = {}
+    skipped = {}
+    for backend in args.face_detectors.split(','):
+        try:
+            create_detector(backend)
+        except DetectorUnavailable as e:
+            skipped[backend] = str(e)
+            continue
+        for stride in sorted({1, args.stride}):
+            # Durations are reported next to the speed, to compare accuracy
+            # across strides
+            start = time.perf_counter()
+            analysis = analyze_video(path, stride=stride, face_detector=backend)
+            results['analysis'][f'{backend}_stride_{stride}'] = {
+                'fps': frames / (time.perf_counter() - start),
+                'analyzed_fraction': analysis['analyzed_frames'] / frames,
+                'detector_calls': analysis['detector_calls'],
+                'lips_moving_seconds': analysis['lips_moving_duration'],
+                'eyes_off_screen_seconds': analysis['eyes_off_screen_duration']
+            }
+    if skipped:
+        results['analysis']['skipped'] = skipped
+    return results
+
+
+def run_startup(args, workdir):
+    # Each run is a new interpreter, so the times include cold imports of
+    # the process's dependencies; the median of the runs is reported
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)),
+               DATABASE_URL='sqlite:///' + os.path.join(workdir, 'startup.db'))
+    results = {}
+    for name, modules in STARTUP_PROCESSES.items():
+        runs = []
+        for _ in range(args.startup_runs):
+            output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT] + modules,
+                                             cwd=workdir, env=env, text=True)
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[name] = {
+            'import_seconds': float(np.median([run['import_seconds'] for run in runs])),
+            'rss_mb': float(np.median([run['rss_bytes'] for run in runs])) / 2 ** 20,
+            'modules': runs[-1]['modules'],
+            'heavy_modules': runs[-1]['heavy_modules']
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, previous=None):
+    def change(new, old):
+        if new is None or not old:
+            return ''
+        return f' ({(new - old) / old * 100:+.1f}%)'
+
+    old_startup = (previous or {}).get('startup', {})
+    for name, stats in results.get('startup', {}).items():
+        old = old_startup.get(name, {})
+        print(f'startup {name:14} {stats["import_seconds"] * 1000:8.1f} ms{change(stats["import_seconds"], old.get("import_seconds"))}'
+              f'  rss {stats["rss_mb"]:6.1f} MB{change(stats["rss_mb"], old.get("rss_mb"))}'
+              f'  modules {stats["modules"]}  loads {", ".join(stats["heavy_modules"]) or "no video libraries"}')
+
+    old_api = (previous or {}).get('api', {})
+    for name, stats in results.get('api', {}).items():
+        old = old_api.get(name, {})
+        line = f'{name:22} {stats["throughput_rps"]:8.1f} req/s{change(stats["throughput_rps"], old.get("throughput_rps"))}'
+        for p in PERCENTILES:
+            key = f'p{p}_ms'
+            line += f'  p{p} {stats[key]:7.2f} ms{change(stats[key], old.get(key))}'
+        if stats['errors']:
+            line += f'  errors {stats["errors"]}'
+        print(line)
+
+    video = results.get('video')
+    if video:
+        old_video = (previous or {}).get('video', {})
+        for key in ('decode_fps', 'transcode_fps'):
+            print(f'{key:22} {video[key]:8.1f} fps{change(video[key], old_video.get(key))}')
+        for key, value in video['analysis'].items():
+            if key == 'skipped':
+                for backend, reason in value.items():
+                    print(f'analysis {backend:22} skipped: {reason}')
+            else:
+                old = old_video.get('analysis', {}).get(key, {})
+                print(f'analysis {key:22} {value["fps"]:8.1f} fps{change(value["fps"], old.get("fps"))}'
+                      f'  analyzed {value["analyzed_fraction"] * 100:5.1f}% of frames'
+                      f'  detector calls {value["detector_calls"]:5}'
+                      f'  lips moving {value["lips_moving_seconds"]:6.2f} s'
+                      f'  eyes off screen {value["eyes_off_screen_seconds"]:6.2f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints and the video pipeline offline.')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--tests', type=int, default=10)
+    parser.add_argument('--questions', type=int, default=50, help='Questions per test')
+    parser.add_argument('--options', type=int, default=4, help='Options per question')
+    parser.add_argument('--answers', type=int, default=1000, help='Submissions to seed before measuring')
+    parser.add_argument('--login-users', type=int, default=20, help='Users that send the measured requests')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset of: ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process test client. '
+                                      'Use with --database-url pointing at the server database.')
+    parser.add_argument('--database-url', help='Database to seed (default: SQLite in a temporary directory)')
+    parser.add_argument('--video-seconds', type=float, default=20)
+    parser.add_argument('--stride', type=int, default=10, help='Analysis stride measured besides stride 1')
+    parser.add_argument('--face-detectors', default='mediapipe,haar',
+                        help='Comma-separated face detector backends to measure the analysis with')
+    parser.add_argument('--skip-api', action='store_true')
+    parser.add_argument('--skip-video', action='store_true')
+    parser.add_argument('--skip-startup', action='store_true')
+    parser.add_argument('--startup-runs', type=int, default=3, help='Interpreters started per process type')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Results file (default: benchmark-<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier results file to report changes against')
+    args = parser.parse_args()
+
+    started = datetime.utcnow()
+    output = os.path.abspath(args.output or f'benchmark-{started.strftime("%Y%m%dT%H%M%S")}.json')
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    # The database URL is read at import time, and recordings are written
+    # relative to the working directory, so both are set before importing
+    workdir = tempfile.mkdtemp(prefix='proctoring-benchmark-')
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+
+    results = {
+        'started_at': started.isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args)
+    }
+
+    # Measured first, in separate interpreters, before this process has
+    # imported anything of its own
+    if not args.skip_startup:
+        results['startup'] = run_startup(args, workdir)
+
+    if not args.skip_api:
+        from app import app
+        from models import engine, create_schema
+        create_schema(engine)
+
+        run_id = f'{random.Random(args.seed).getrandbits(32):08x}' if not args.database_url else os.urandom(4).hex()
+        start = time.perf_counter()
+        admin_name, usernames, tests, attempts = seed(args, run_id)
+        results['seed_seconds'] = time.perf_counter() - start
+
+        make_client = (lambda: HttpClient(args.url)) if args.url else (lambda: TestClient(app))
+        scenarios = build_scenarios(make_client, admin_name, usernames, tests, attempts, args)
+        results['api'] = {}
+        for n, name in enumerate(e for e in args.endpoints.split(',') if e):
+            if name not in scenarios:
+                parser.error(f'Unknown endpoint {name}')
+            results['api'][name] = run_endpoint(make_client, scenarios[name], args, args.seed + n)
+
+    if not args.skip_video:
+        results['video'] = run_video(args, workdir)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_report(results, previous)
+    print('Results written to', output)
+
+
+if __name__ == '__main__':
+    main()
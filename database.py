@@ -1,6 +1,135 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import os
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
-DATABASE_URL = 'sqlite:///exam_proctoring.db'
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
\ No newline at end of file
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///exam_proctoring.db')
+
+# Pool sizing for server databases (and file-backed SQLite, which also pools)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+# SQLite tuning for many concurrent readers and one writer at a time
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            self.wait_time += seconds
+            self.max_wait_time = max(self.max_wait_time, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+
+pool_stats_counters = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    # Times how long callers wait for a pooled connection
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_stats_counters.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats_counters.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def _engine_options(url):
+    url = make_url(url)
+    options = {'pool_pre_ping': True}
+    if url.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases live in a single connection; leave the default pool
+            return options
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE
+    )
+    return options
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+
+
+@event.listens_for(engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    with pool_stats_counters.lock:
+        pool_stats_counters.connects += 1
+    if engine.dialect.name == 'sqlite':
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.close()
+
+
+@event.listens_for(engine, 'savepoint')
+def _on_savepoint(connection, name):
+    # pysqlite only begins a transaction before DML, so a SAVEPOINT issued
+    # first would itself become the outer transaction and its RELEASE would
+    # commit. Begin the transaction explicitly in that case. Savepoints wrap
+    # writes, so BEGIN IMMEDIATE takes the write lock right away (waiting on
+    # busy_timeout): reads inside the savepoint then see no other writer's
+    # commits until this transaction ends, which SQLite's ignored
+    # SELECT ... FOR UPDATE would not ensure.
+    if engine.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+@event.listens_for(engine, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    with pool_stats_counters.lock:
+        pool_stats_counters.checkouts += 1
+
+
+Session = sessionmaker(bind=engine)
+
+# One session per Flask request (per thread), removed on app context teardown
+db_session = scoped_session(Session)
+
+
+def init_app(app):
+    @app.teardown_appcontext
+    def remove_db_session(exception=None):
+        db_session.remove()
+
+
+def pool_stats():
+    pool = engine.pool
+    stats = {
+        'checkouts': pool_stats_counters.checkouts,
+        'connects': pool_stats_counters.connects,
+        'wait_time_total': pool_stats_counters.wait_time,
+        'wait_time_max': pool_stats_counters.max_wait_time,
+        'timeouts': pool_stats_counters.timeouts
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            checked_in=pool.checkedin()
+        )
+    return stats
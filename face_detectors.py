@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+# Face detector backends. A detector is a callable that takes a BGR frame
+# and returns (boxes, scores): an (N, 4) array of pixel x1 y1 x2 y2 boxes and
+# an (N,) array of scores. Libraries are imported when a detector is
+# created, so API processes can list and validate backends without loading
+# them.
+DEFAULT_FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'mediapipe')
+MIN_DETECTION_CONFIDENCE = float(os.environ.get('FACE_MIN_CONFIDENCE', 0.5))
+# Frames are scaled down to this width before the Haar cascade runs
+HAAR_DETECT_WIDTH = int(os.environ.get('HAAR_DETECT_WIDTH', 320))
+# Smallest face searched for, in pixels at that width. A webcam shows the
+# student's face larger than this; every smaller scale searched costs time.
+HAAR_MIN_FACE = 40
+# Model (and config) for the dnn backend, e.g. OpenCV's res10 SSD face model:
+# res10_300x300_ssd_iter_140000.caffemodel with its deploy.prototxt
+FACE_DNN_MODEL = os.environ.get('FACE_DNN_MODEL')
+FACE_DNN_CONFIG = os.environ.get('FACE_DNN_CONFIG')
+DNN_INPUT_SIZE = 300
+DNN_MEAN = (104.0, 177.0, 123.0)
+
+
+class DetectorUnavailable(Exception):
+    pass
+
+
+def _no_faces():
+    return np.zeros((0, 4), dtype=np.float64), np.zeros(0, dtype=np.float64)
+
+
+class MediaPipeFaceDetector:
+    # MediaPipe face detection. Finds turned and partly covered faces the
+    # OpenCV backends miss, at several times their CPU cost.
+    name = 'mediapipe'
+    landmarks = True  # Analysis runs FaceMesh for eye and lip landmarks
+
+    def __init__(self, min_detection_confidence=MIN_DETECTION_CONFIDENCE):
+        try:
+            import mediapipe as mp
+        except ImportError:
+            raise DetectorUnavailable('mediapipe is not installed')
+        self._detector = mp.solutions.face_detection.FaceDetection(min_detection_confidence=min_detection_confidence)
+
+    def __call__(self, frame):
+        import cv2
+        height, width = frame.shape[:2]
+        results = self._detector.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not results.detections:
+            return _no_faces()
+        boxes = []
+        scores = []
+        for detection in results.detections:
+            box = detection.location_data.relative_bounding_box
+            boxes.append([box.xmin * width, box.ymin * height,
+                          (box.xmin + box.width) * width, (box.ymin + box.height) * height])
+            scores.append(detection.score[0])
+        return np.asarray(boxes, dtype=np.float64), np.asarray(scores, dtype=np.float64)
+
+
+class HaarFaceDetector:
+    # OpenCV's bundled frontal face cascade. The cheapest backend; it misses
+    # faces turned more than about 30 degrees, and its scores aren't
+    # probabilities.
+    name = 'haar'
+    landmarks = False
+
+    def __init__(self, detect_width=HAAR_DETECT_WIDTH, cascade='haarcascade_frontalface_default.xml'):
+        import cv2
+        path = os.path.join(cv2.data.haarcascades, cascade)
+        self._cascade = cv2.CascadeClassifier(path)
+        if self._cascade.empty():
+            raise DetectorUnavailable(f'Could not load {path}')
+        self.detect_width = detect_width
+
+    def __call__(self, frame):
+        import cv2
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = min(1.0, self.detect_width / gray.shape[1])
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.equalizeHist(gray)
+        rects, _, weights = self._cascade.detectMultiScale3(
+            gray, scaleFactor=1.1, minNeighbors=5, minSize=(HAAR_MIN_FACE, HAAR_MIN_FACE), outputRejectLevels=True)
+        if not len(rects):
+            return _no_faces()
+        rects = np.asarray(rects, dtype=np.float64) / scale
+        boxes = np.column_stack((rects[:, 0], rects[:, 1], rects[:, 0] + rects[:, 2], rects[:, 1] + rects[:, 3]))
+        return boxes, np.asarray(weights, dtype=np.float64).reshape(-1)
+
+
+class DnnFaceDetector:
+    # SSD face detector run with cv2.dnn on the CPU. Close to MediaPipe on
+    # frontal and moderately turned faces at a fraction of its cost. The
+    # model isn't shipped with OpenCV; point FACE_DNN_MODEL at it.
+    name = 'dnn'
+    landmarks = False
+
+    def __init__(self, model=FACE_DNN_MODEL, config=FACE_DNN_CONFIG, min_detection_confidence=MIN_DETECTION_CONFIDENCE):
+        import cv2
+        if not model or not os.path.exists(model):
+            raise DetectorUnavailable('Set FACE_DNN_MODEL to a face detection model file')
+        self._net = cv2.dnn.readNet(model, config or '')
+        self.min_detection_confidence = min_detection_confidence
+
+    def __call__(self, frame):
+        import cv2
+        height, width = frame.shape[:2]
+        self._net.setInput(cv2.dnn.blobFromImage(frame, 1.0, (DNN_INPUT_SIZE, DNN_INPUT_SIZE), DNN_MEAN))
+        # One row per detection: image id, class, score, then the box
+        # corners relative to the frame
+        detections = self._net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.min_detection_confidence]
+        boxes = np.clip(detections[:, 3:7], 0.0, 1.0) * [width, height, width, height]
+        return boxes.astype(np.float64), detections[:, 2].astype(np.float64)
+
+
+FACE_DETECTORS = {
+    'mediapipe': MediaPipeFaceDetector,
+    'haar': HaarFaceDetector,
+    'dnn': DnnFaceDetector
+}
+
+
+def create_detector(name=None):
+    name = name or DEFAULT_FACE_DETECTOR
+    if name not in FACE_DETECTORS:
+        raise ValueError(f'Unknown face detector {name}')
+    return FACE_DETECTORS[name]()
+
+
+def compare_detectors(video_path, names, stride=1, max_frames=None):
+    # Run every backend on the same frames of a video. Reports each
+    # backend's frames per second and how often it agrees with the first
+    # backend: on the number of faces, on whether any face is present, and
+    # on where the faces are (mean IoU of matched boxes).
+    import cv2
+    from face_tracking import iou_matrix, match_boxes
+
+    detectors = [create_detector(name) for name in names]
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f'Could not open video {video_path}')
+
+    seconds = np.zeros(len(detectors))
+    counts = [[] for _ in detectors]
+    ious = [[] for _ in detectors]
+    frames = 0
+    index = 0
+    try:
+        while max_frames is None or frames < max_frames:
+            if index % stride:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            index += 1
+            frames += 1
+
+            results = []
+            for k, detector in enumerate(detectors):
+                start = time.perf_counter()
+                boxes, _ = detector(frame)
+                seconds[k] += time.perf_counter() - start
+                results.append(np.asarray(boxes, dtype=np.float64).reshape(-1, 4))
+                counts[k].append(len(results[k]))
+
+            for k in range(1, len(detectors)):
+                pairs, _, _ = match_boxes(results[0], results[k])
+                if pairs:
+                    iou = iou_matrix(results[0], results[k])
+                    ious[k].extend(iou[row, col] for row, col in pairs)
+    finally:
+        cap.release()
+
+    reference = np.asarray(counts[0])
+    report = {'video': video_path, 'frames': frames, 'stride': stride, 'reference': names[0], 'backends': {}}
+    for k, name in enumerate(names):
+        faces = np.asarray(counts[k])
+        entry = {
+            'fps': frames / seconds[k] if seconds[k] else None,
+            'mean_faces': float(faces.mean()) if frames else None,
+            'frames_with_face': float((faces > 0).mean()) if frames else None,
+            'frames_with_multiple_faces': float((faces > 1).mean()) if frames else None
+        }
+        if k:
+            entry['count_agreement'] = float((faces == reference).mean()) if frames else None
+            entry['presence_agreement'] = float(((faces > 0) == (reference > 0)).mean()) if frames else None
+            entry['mean_iou'] = float(np.mean(ious[k])) if ious[k] else None
+        report['backends'][name] = entry
+    return report
+
+
+def _format(value, pattern):
+    return pattern.format(value) if value is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare face detector backends on a video.')
+    parser.add_argument('video')
+    parser.add_argument('--backends', default='mediapipe,haar',
+                        help='Comma-separated backends; the first is the reference. Any of: ' + ', '.join(FACE_DETECTORS))
+    parser.add_argument('--stride', type=int, default=1, help='Compare every Nth frame')
+    parser.add_argument('--max-frames', type=int, help='Stop after this many compared frames')
+    parser.add_argument('--output', help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    names = [name for name in args.backends.split(',') if name]
+    for name in names:
+        if name not in FACE_DETECTORS:
+            parser.error(f'Unknown face detector {name}')
+    try:
+        report = compare_detectors(args.video, names, max(args.stride, 1), args.max_frames)
+    except DetectorUnavailable as e:
+        parser.error(str(e))
+
+    print(f'{report["frames"]} frames, agreement against {report["reference"]}')
+    for name, entry in report['backends'].items():
+        line = (f'{name:10} {_format(entry["fps"], "{:8.1f}")} fps  faces/frame {_format(entry["mean_faces"], "{:.2f}")}'
+                f'  with face {_format(entry["frames_with_face"], "{:.1%}")}'
+                f'  several {_format(entry["frames_with_multiple_faces"], "{:.1%}")}')
+        if name != report['reference']:
+            line += (f'  count {_format(entry["count_agreement"], "{:.1%}")}'
+                     f'  presence {_format(entry["presence_agreement"], "{:.1%}")}'
+                     f'  IoU {_format(entry["mean_iou"], "{:.2f}")}')
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
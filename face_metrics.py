@@ -0,0 +1,96 @@
+import numpy as np
+
+# FaceMesh landmark indices (refine_landmarks=True adds the iris points 468-477)
+LEFT_EYE_OUTER = 33
+LEFT_EYE_INNER = 133
+RIGHT_EYE_INNER = 362
+RIGHT_EYE_OUTER = 263
+LEFT_IRIS = 468
+RIGHT_IRIS = 473
+UPPER_LIP = 13
+LOWER_LIP = 14
+FOREHEAD = 10
+CHIN = 152
+NOSE_TIP = 1
+
+# Only the landmarks the metrics use are copied out of each FaceMesh result
+METRIC_LANDMARKS = (LEFT_EYE_OUTER, LEFT_EYE_INNER, RIGHT_EYE_INNER, RIGHT_EYE_OUTER,
+                    LEFT_IRIS, RIGHT_IRIS, UPPER_LIP, LOWER_LIP, FOREHEAD, CHIN, NOSE_TIP)
+_COLUMN = {landmark: column for column, landmark in enumerate(METRIC_LANDMARKS)}
+
+# Iris position across the eye (0 = outer corner, 1 = inner corner) that
+# still counts as looking at the screen
+GAZE_MIN = 0.35
+GAZE_MAX = 0.65
+# Change in lip aperture (relative to face height) between frames that
+# counts as the lips moving
+LIP_MOVEMENT_THRESHOLD = 0.008
+
+
+def landmarks_to_array(landmarks):
+    # (len(METRIC_LANDMARKS), 3) array of x, y, z for one face
+    return np.array([(landmarks[i].x, landmarks[i].y, landmarks[i].z) for i in METRIC_LANDMARKS],
+                    dtype=np.float32)
+
+
+def face_boxes(faces, width, height):
+    # (len(faces), 4) pixel boxes, as x1 y1 x2 y2, around each FaceMesh face
+    boxes = np.empty((len(faces), 4), dtype=np.float64)
+    for i, face in enumerate(faces):
+        xy = np.array([(landmark.x, landmark.y) for landmark in face.landmark]) * (width, height)
+        boxes[i, :2] = xy.min(axis=0)
+        boxes[i, 2:] = xy.max(axis=0)
+    return boxes
+
+
+def no_face_array():
+    # Placeholder for a frame without a face; every signal computes to NaN
+    return np.full((len(METRIC_LANDMARKS), 3), np.nan, dtype=np.float32)
+
+
+def _coordinate(points, landmark, axis):
+    return points[:, _COLUMN[landmark], axis]
+
+
+def _safe_ratio(numerator, denominator, default):
+    out = np.full(numerator.shape, default, dtype=np.float32)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+def gaze_ratio(points):
+    # points: (frames, len(METRIC_LANDMARKS), 3). Mean iris position across both eyes.
+    def eye(outer, inner, iris):
+        outer_x = _coordinate(points, outer, 0)
+        return _safe_ratio(_coordinate(points, iris, 0) - outer_x,
+                           _coordinate(points, inner, 0) - outer_x, 0.5)
+
+    return (eye(LEFT_EYE_OUTER, LEFT_EYE_INNER, LEFT_IRIS) +
+            eye(RIGHT_EYE_OUTER, RIGHT_EYE_INNER, RIGHT_IRIS)) / 2
+
+
+def eyes_off_screen(points):
+    # Frames without a face count as looking away
+    ratio = gaze_ratio(points)
+    return np.isnan(ratio) | (ratio < GAZE_MIN) | (ratio > GAZE_MAX)
+
+
+def lip_aperture(points):
+    face_height = np.abs(_coordinate(points, CHIN, 1) - _coordinate(points, FOREHEAD, 1))
+    opening = np.abs(_coordinate(points, LOWER_LIP, 1) - _coordinate(points, UPPER_LIP, 1))
+    return _safe_ratio(opening, face_height, 0.0)
+
+
+def lips_moving(aperture, previous_aperture):
+    # A frame's lips are moving if the aperture changed since the frame
+    # before it (previous_aperture, per frame); frames next to a missing face
+    # never count
+    return np.abs(aperture - previous_aperture) > LIP_MOVEMENT_THRESHOLD
+
+
+def head_pose(points):
+    # Horizontal nose offset from the midpoint between the eyes, relative to
+    # eye distance; a cheap proxy for head yaw
+    left = _coordinate(points, LEFT_EYE_OUTER, 0)
+    right = _coordinate(points, RIGHT_EYE_OUTER, 0)
+    return _safe_ratio(_coordinate(points, NOSE_TIP, 0) - (left + right) / 2, np.abs(right - left), 0.0)
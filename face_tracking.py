@@ -0,0 +1,192 @@
+import itertools
+import cv2
+import numpy as np
+
+DETECT_INTERVAL = 10  # Frames between detector runs while every track holds
+IOU_THRESHOLD = 0.3
+# Detections this far from a track's centre, relative to its diagonal, can
+# still continue it when the boxes barely overlap (fast movement)
+MAX_CENTER_DISTANCE = 0.5
+MIN_HITS = 2  # Detector hits before a track counts as a person
+MAX_MISSES = 2  # Detector runs a track may be missing from before it is dropped
+TRACK_CONFIDENCE = 0.5  # Template match score below which the detector runs early
+TEMPLATE_SIZE = 32  # Tracked faces are matched as 32x32 grayscale templates
+SEARCH_MARGIN = 0.5  # Search window padding, relative to the box size
+
+
+def iou_matrix(a, b):
+    # IoU of every box in a (N, 4) against every box in b (M, 4), as x1 y1 x2 y2
+    a = a[:, np.newaxis, :]
+    b = b[np.newaxis, :, :]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def center_distance_matrix(a, b):
+    # Centre distances between boxes, relative to the diagonal of the a box
+    centers_a = (a[:, :2] + a[:, 2:]) / 2
+    centers_b = (b[:, :2] + b[:, 2:]) / 2
+    diagonal = np.hypot(a[:, 2] - a[:, 0], a[:, 3] - a[:, 1])[:, np.newaxis]
+    distance = np.linalg.norm(centers_a[:, np.newaxis, :] - centers_b[np.newaxis, :, :], axis=2)
+    return distance / np.maximum(diagonal, 1e-6)
+
+
+def match_boxes(track_boxes, detection_boxes, iou_threshold=IOU_THRESHOLD, max_center_distance=MAX_CENTER_DISTANCE):
+    # Greedy one-to-one matching on a combined score: overlapping pairs
+    # (IoU above the threshold) rank above pairs that are only close.
+    # Returns (pairs, unmatched track indices, unmatched detection indices).
+    n, m = len(track_boxes), len(detection_boxes)
+    if n == 0 or m == 0:
+        return [], list(range(n)), list(range(m))
+
+    iou = iou_matrix(track_boxes, detection_boxes)
+    distance = center_distance_matrix(track_boxes, detection_boxes)
+    score = np.where(iou >= iou_threshold, 1 + iou, np.where(distance <= max_center_distance, 1 - distance, 0))
+
+    order = np.argsort(-score, axis=None)
+    rows, cols = np.unravel_index(order, score.shape)
+    candidates = score[rows, cols] > 0
+
+    pairs = []
+    used_tracks = np.zeros(n, dtype=bool)
+    used_detections = np.zeros(m, dtype=bool)
+    for row, col in zip(rows[candidates].tolist(), cols[candidates].tolist()):
+        if used_tracks[row] or used_detections[col]:
+            continue
+        used_tracks[row] = used_detections[col] = True
+        pairs.append((row, col))
+    return pairs, np.flatnonzero(~used_tracks).tolist(), np.flatnonzero(~used_detections).tolist()
+
+
+class Track:
+    def __init__(self, track_id, box, template):
+        self.id = track_id
+        self.box = box
+        self.template = template
+        self.hits = 1
+        self.misses = 0
+        self.confidence = 1.0
+
+    @property
+    def confirmed(self):
+        return self.hits >= MIN_HITS
+
+
+def _template(gray, box):
+    x1, y1, x2, y2 = np.round(box).astype(int)
+    height, width = gray.shape
+    x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    return cv2.resize(gray[y1:y2, x1:x2], (TEMPLATE_SIZE, TEMPLATE_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def _follow(gray, track):
+    # Find the track's template near its last box. The search window is
+    # scaled so the face appears at template size. Returns (box, score).
+    x1, y1, x2, y2 = track.box
+    width, height = x2 - x1, y2 - y1
+    if track.template is None or width < 2 or height < 2:
+        return track.box, 0.0
+
+    frame_height, frame_width = gray.shape
+    left = int(max(x1 - width * SEARCH_MARGIN, 0))
+    top = int(max(y1 - height * SEARCH_MARGIN, 0))
+    right = int(min(x2 + width * SEARCH_MARGIN, frame_width))
+    bottom = int(min(y2 + height * SEARCH_MARGIN, frame_height))
+
+    scale_x, scale_y = TEMPLATE_SIZE / width, TEMPLATE_SIZE / height
+    window_width = int((right - left) * scale_x)
+    window_height = int((bottom - top) * scale_y)
+    if window_width < TEMPLATE_SIZE or window_height < TEMPLATE_SIZE:
+        return track.box, 0.0
+
+    window = cv2.resize(gray[top:bottom, left:right], (window_width, window_height), interpolation=cv2.INTER_AREA)
+    scores = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+
+    new_x1 = left + match_x / scale_x
+    new_y1 = top + match_y / scale_y
+    return np.array([new_x1, new_y1, new_x1 + width, new_y1 + height]), float(score)
+
+
+class FaceTracker:
+    # Keeps stable ids for the faces in a video. The detector runs every
+    # `detect_interval` frames, or sooner when a tracked face can no longer
+    # be followed; in between, faces are followed by template matching, which
+    # costs a fraction of a detector call.
+    #
+    # `detect` is a face detector backend from face_detectors, or any
+    # callable with the same signature. It may be None when every frame comes
+    # with the boxes found on it (see update).
+    def __init__(self, detect, detect_interval=DETECT_INTERVAL):
+        self.detect = detect
+        self.detect_interval = detect_interval
+        self.tracks = []
+        self.frames = 0
+        self.detector_calls = 0
+        self._ids = itertools.count(1)
+        self._since_detection = None
+
+    @property
+    def people(self):
+        # Confirmed tracks currently in view
+        return [track for track in self.tracks if track.confirmed]
+
+    @property
+    def settled(self):
+        # Whether every track is confirmed and was found by the last
+        # detection. Until then the detector runs on every frame, so a face
+        # that appeared is confirmed, and one that left is dropped, within
+        # a few frames.
+        return all(track.confirmed and not track.misses for track in self.tracks)
+
+    def update(self, frame, boxes=None):
+        # Process one BGR frame and return the confirmed tracks. `boxes` are
+        # faces already found on the frame (by FaceMesh, say), used instead
+        # of running the detector.
+        self.frames += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        due = (boxes is not None or self._since_detection is None
+               or self._since_detection + 1 >= self.detect_interval or not self.settled)
+        if not due and self.tracks:
+            for track in self.tracks:
+                track.box, track.confidence = _follow(gray, track)
+            due = any(track.confidence < TRACK_CONFIDENCE for track in self.tracks)
+
+        if due:
+            self._run_detector(frame, gray, boxes)
+        else:
+            self._since_detection += 1
+        return self.people
+
+    def _run_detector(self, frame, gray, boxes=None):
+        self._since_detection = 0
+        if boxes is None:
+            self.detector_calls += 1
+            boxes, _ = self.detect(frame)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+        track_boxes = np.array([track.box for track in self.tracks], dtype=np.float64).reshape(-1, 4)
+        pairs, unmatched_tracks, unmatched_detections = match_boxes(track_boxes, boxes)
+
+        for t, d in pairs:
+            track = self.tracks[t]
+            track.box = boxes[d]
+            track.template = _template(gray, boxes[d])
+            track.hits += 1
+            track.misses = 0
+            track.confidence = 1.0
+        for t in unmatched_tracks:
+            self.tracks[t].misses += 1
+            self.tracks[t].confidence = 0.0
+        for d in unmatched_detections:
+            self.tracks.append(Track(next(self._ids), boxes[d], _template(gray, boxes[d])))
+
+        self.tracks = [track for track in self.tracks if track.misses <= MAX_MISSES]
@@ -0,0 +1,142 @@
+import threading
+import numpy as np
+from sqlalchemy import select, insert
+from models import Question, Option, UserAnswer
+from invalidation import on_question_set_changed, question_set_version
+from results import record_attempt
+
+
+class AnswerKey:
+    # Compact, read-only answer key for one question set. Options are kept
+    # sorted by id so a whole submission can be resolved with one searchsorted.
+    def __init__(self, question_ids, option_ids, option_question_ids, option_correct, version=None):
+        self.version = version  # Content version of the set the key was loaded at
+        self.question_ids = question_ids
+        self.option_ids = option_ids
+        self.option_question_ids = option_question_ids
+        self.option_correct = option_correct
+
+    @classmethod
+    def load(cls, session, question_set_id, version=None):
+        question_ids = session.execute(
+            select(Question.id).where(Question.question_set_id == question_set_id)
+        ).scalars().all()
+        rows = session.execute(
+            select(Option.id, Option.question_id, Option.is_correct)
+            .join(Question, Option.question_id == Question.id)
+            .where(Question.question_set_id == question_set_id)
+            .order_by(Option.id)
+        ).all()
+
+        option_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        option_question_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        option_correct = np.fromiter((bool(r[2]) for r in rows), dtype=bool, count=len(rows))
+        return cls(np.sort(np.asarray(question_ids, dtype=np.int64)), option_ids, option_question_ids, option_correct, version)
+
+    def grade(self, question_ids, option_ids):
+        # Returns (question_ok, option_ok, is_correct) arrays aligned with the submission
+        question_ok = np.isin(question_ids, self.question_ids)
+
+        idx = np.searchsorted(self.option_ids, option_ids)
+        idx_clipped = np.minimum(idx, max(len(self.option_ids) - 1, 0))
+        if len(self.option_ids):
+            option_ok = (idx < len(self.option_ids)) & (self.option_ids[idx_clipped] == option_ids)
+            option_ok &= self.option_question_ids[idx_clipped] == question_ids
+            is_correct = option_ok & self.option_correct[idx_clipped]
+        else:
+            option_ok = np.zeros(len(option_ids), dtype=bool)
+            is_correct = option_ok.copy()
+        return question_ok, option_ok, is_correct
+
+
+_answer_keys = {}
+_answer_key_lock = threading.Lock()
+
+
+def get_answer_key(session, question_set_id):
+    # The cached key is used while the set's content version is unchanged,
+    # so questions added by another process are graded by the next request
+    version = question_set_version(session, question_set_id)
+    with _answer_key_lock:
+        key = _answer_keys.get(question_set_id)
+    if key is not None and key.version == version:
+        return key
+
+    # Loaded after the version was read: a change committed in between
+    # leaves a key tagged older than it is, and it is reloaded next time
+    key = AnswerKey.load(session, question_set_id, version)
+    with _answer_key_lock:
+        _answer_keys[question_set_id] = key
+    return key
+
+
+def invalidate_answer_key(question_set_id):
+    with _answer_key_lock:
+        _answer_keys.pop(question_set_id, None)
+
+
+on_question_set_changed(invalidate_answer_key)
+
+
+class SubmissionError(Exception):
+    pass
+
+
+def parse_answers(answers):
+    # Turns [{'question_id', 'option_id'}, ...] into two id arrays. Raises
+    # SubmissionError on the first malformed answer.
+    question_ids = []
+    option_ids = []
+    for answer_data in answers:
+        question_id = answer_data.get('question_id')
+        option_id = answer_data.get('option_id')
+        if not question_id or not option_id:
+            raise SubmissionError('Missing question_id or option_id')
+        try:
+            question_ids.append(int(question_id))
+            option_ids.append(int(option_id))
+        except (TypeError, ValueError):
+            raise SubmissionError('Invalid question_id or option_id')
+
+    return np.asarray(question_ids, dtype=np.int64), np.asarray(option_ids, dtype=np.int64)
+
+
+def check_answers(key, question_ids, option_ids):
+    # Raises SubmissionError on the first answer that doesn't belong to the
+    # key's question set
+    question_ok, option_ok, _ = key.grade(question_ids, option_ids)
+
+    invalid = np.flatnonzero(~(question_ok & option_ok))
+    if len(invalid):
+        i = invalid[0]
+        if not question_ok[i]:
+            raise SubmissionError(f'Question {question_ids[i]} not found in the specified question set')
+        raise SubmissionError(f'Option {option_ids[i]} not found for the question')
+
+
+def grade_attempt(session, attempt, question_ids, option_ids):
+    # Score an attempt's final answers in one pass, bulk-insert the
+    # UserAnswer rows and fold the score into the result summaries. Returns
+    # the AttemptResult. Answers were checked when they were saved; any whose
+    # question or option has been removed since are dropped.
+    key = get_answer_key(session, attempt.question_set_id)
+    question_ok, option_ok, is_correct = key.grade(question_ids, option_ids)
+    valid = question_ok & option_ok
+    question_ids, option_ids, is_correct = question_ids[valid], option_ids[valid], is_correct[valid]
+
+    marks = is_correct.astype(np.float64)
+    rows = [
+        {
+            'user_id': attempt.user_id,
+            'attempt_id': attempt.id,
+            'question_id': q,
+            'option_id': o,
+            'is_correct': c,
+            'marks_obtained': m,
+        }
+        for q, o, c, m in zip(question_ids.tolist(), option_ids.tolist(), is_correct.tolist(), marks.tolist())
+    ]
+    if rows:
+        session.execute(insert(UserAnswer), rows)
+
+    return record_attempt(session, attempt.user_id, attempt.question_set_id, len(key.question_ids), question_ids, is_correct)
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from models import User
+from invalidation import on_user_changed
+
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 300))
+
+# Detached snapshot of the fields endpoints read from current_user. ORM
+# instances are not cached because they are bound to one request's session.
+CachedUser = namedtuple('CachedUser', ['id', 'username', 'role'])
+
+
+class TTLCache:
+    # Bounded LRU cache whose entries also expire after `ttl` seconds
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+user_cache = TTLCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+
+
+def load_user(session, user_id):
+    # Cached lookup of the JWT identity; returns None for unknown users
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    row = session.query(User.id, User.username, User.role).filter_by(id=user_id).first()
+    if row is None:
+        return None
+
+    user = CachedUser(row.id, row.username, row.role)
+    user_cache.set(user_id, user)
+    return user
+
+
+on_user_changed(user_cache.invalidate)
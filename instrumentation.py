@@ -0,0 +1,198 @@
+import logging
+import os
+import threading
+import time
+from flask import request, g
+from sqlalchemy import event
+
+# Requests slower than this many seconds are logged; 0 turns the log off
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger('proctoring')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Gauge:
+    # Read when scraped. The callback returns a number, or a dict of label
+    # tuples to numbers.
+    def __init__(self, name, help, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = labelnames
+
+    def render(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning('Gauge %s failed: %s', self.name, e)
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.add(Histogram(
+    'http_request_duration_seconds', 'Request latency by blueprint and route',
+    ('blueprint', 'route', 'method', 'status')))
+request_queries = registry.add(Histogram(
+    'http_request_db_queries', 'Database queries per request',
+    ('blueprint', 'route'), buckets=QUERY_COUNT_BUCKETS))
+request_query_time = registry.add(Histogram(
+    'http_request_db_query_seconds', 'Time spent in database queries per request',
+    ('blueprint', 'route')))
+db_queries = registry.add(Counter('db_queries_total', 'Database queries, including background work'))
+db_query_seconds = registry.add(Counter('db_query_seconds_total', 'Time spent in database queries'))
+background_errors = registry.add(Counter(
+    'background_errors_total', 'Errors in background threads and workers', ('component',)))
+
+
+def register_gauge(name, help, callback, labelnames=()):
+    return registry.add(Gauge(name, help, callback, labelnames))
+
+
+def record_error(component, error):
+    background_errors.inc((component,))
+    logger.error('%s error: %s', component, error)
+
+
+# Queries are attributed to the request running on the same thread
+_query_state = threading.local()
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        db_queries.inc()
+        db_query_seconds.inc(amount=elapsed)
+        counts = getattr(_query_state, 'counts', None)
+        if counts is not None:
+            counts[0] += 1
+            counts[1] += elapsed
+
+
+def init_app(app):
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        _query_state.counts = [0, 0.0]
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('request_started', None)
+        counts = getattr(_query_state, 'counts', None) or [0, 0.0]
+        _query_state.counts = None
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+
+        # Route templates keep the label set small; unmatched URLs share one
+        blueprint = request.blueprint or ''
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        request_latency.observe((blueprint, route, request.method, str(response.status_code)), elapsed)
+        request_queries.observe((blueprint, route), counts[0])
+        request_query_time.observe((blueprint, route), counts[1])
+
+        if response.status_code == 500:
+            # Endpoints turn exceptions into JSON 500s, so log what they caught
+            body = response.get_json(silent=True) if response.is_json else None
+            logger.error('%s %s failed: %s', request.method, request.path, (body or {}).get('error'))
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            logger.warning('Slow request: %s %s %d in %.3fs (%d queries, %.3fs in database)',
+                           request.method, request.path, response.status_code, elapsed, counts[0], counts[1])
+        return response
@@ -0,0 +1,93 @@
+from sqlalchemy import event, select, update, func
+from models import Question, Option, QuestionSet, User
+from database import Session
+
+# Callbacks run with a question_set_id after a commit that wrote questions
+# or options belonging to that set. Used to drop per-set caches in this
+# process; other processes notice the change through question_set_version.
+_question_set_listeners = []
+# Callbacks run with a user id after a commit that updated or deleted that user
+_user_listeners = []
+
+
+def on_question_set_changed(callback):
+    _question_set_listeners.append(callback)
+    return callback
+
+
+def question_set_changed(question_set_id):
+    for callback in _question_set_listeners:
+        callback(question_set_id)
+
+
+def mark_question_set_changed(session, question_set_id):
+    # For writes that bypass the unit of work (bulk inserts), so the flush
+    # hook can't see them; listeners still run after the commit
+    session.info.setdefault('changed_question_sets', set()).add(question_set_id)
+
+
+def question_set_version(session, question_set_id):
+    # Content version of a question set, or None if it doesn't exist. A
+    # primary-key lookup, cheap enough to check on every cache hit.
+    row = session.execute(
+        select(QuestionSet.content_version).where(QuestionSet.id == question_set_id)
+    ).first()
+    if row is None:
+        return None
+    return row[0] or 0
+
+
+def on_user_changed(callback):
+    _user_listeners.append(callback)
+    return callback
+
+
+def user_changed(user_id):
+    for callback in _user_listeners:
+        callback(user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed_sets = session.info.setdefault('changed_question_sets', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Question):
+            changed_sets.add(obj.question_set_id)
+        elif isinstance(obj, Option):
+            question = obj.question or session.get(Question, obj.question_id)
+            if question is not None:
+                changed_sets.add(question.question_set_id)
+
+    changed_users = session.info.setdefault('changed_users', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed_users.add(obj.id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_versions(session):
+    # Flush first so the hook above has seen every change being committed
+    session.flush()
+    changed_sets = session.info.get('changed_question_sets')
+    changed_sets = {question_set_id for question_set_id in changed_sets or () if question_set_id is not None}
+    if changed_sets:
+        session.execute(
+            update(QuestionSet)
+            .where(QuestionSet.id.in_(changed_sets))
+            .values(content_version=func.coalesce(QuestionSet.content_version, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_changes(session):
+    for question_set_id in session.info.pop('changed_question_sets', ()):
+        question_set_changed(question_set_id)
+    for user_id in session.info.pop('changed_users', ()):
+        user_changed(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_question_sets', None)
+    session.info.pop('changed_users', None)
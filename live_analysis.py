@@ -0,0 +1,229 @@
+import os
+import queue
+import threading
+import time
+import numpy as np
+import face_metrics
+from instrumentation import record_error
+
+LIVE_ANALYSIS_ENABLED = os.environ.get('LIVE_ANALYSIS', '0') == '1'
+LIVE_BATCH_SIZE = int(os.environ.get('LIVE_BATCH_SIZE', 32))
+# Longest a frame waits for its batch to fill before the batch runs anyway
+LIVE_LATENCY_BUDGET = float(os.environ.get('LIVE_LATENCY_BUDGET', 0.25))
+# Seconds between analyzed frames of one session; the rest are skipped
+LIVE_SAMPLE_INTERVAL = float(os.environ.get('LIVE_SAMPLE_INTERVAL', 0.5))
+LIVE_QUEUE_SIZE = 512
+LIVE_FRAME_WIDTH = 320  # Frames are downscaled to this width before inference
+
+
+class LiveSession:
+    def __init__(self, upload_id, user_id, admin_id):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.admin_id = admin_id
+        self.last_submitted = 0.0
+        self.flags = None
+        self.flag_counts = {'no_face': 0, 'multiple_faces': 0, 'eyes_off_screen': 0}
+        self.tracker = None  # FaceTracker over the session's analyzed frames, made on the first one
+
+
+class LiveAnalysisService:
+    # Collects sampled frames from every live recording on this node into
+    # micro-batches and runs them through one shared FaceMesh, then publishes
+    # no-face / multiple-faces / eyes-off-screen flags per session. A batch
+    # runs when it is full or when its oldest frame has waited the latency
+    # budget, so flags lag the student by roughly the budget plus inference.
+    def __init__(self, batch_size=LIVE_BATCH_SIZE, latency_budget=LIVE_LATENCY_BUDGET,
+                 sample_interval=LIVE_SAMPLE_INTERVAL, queue_size=LIVE_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.latency_budget = latency_budget
+        self.sample_interval = sample_interval
+        self.enabled = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._face_mesh = None
+        self.batches = 0
+        self.frames_analyzed = 0
+        self.frames_dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self.enabled = True
+            self._thread = threading.Thread(target=self._run, name='live-analysis', daemon=True)
+            self._thread.start()
+
+    def shutdown(self, timeout=5):
+        # Stop the analysis thread before the process exits, so it isn't
+        # torn down inside OpenCV; frames still queued are dropped
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def register(self, upload_id, user_id, admin_id):
+        if self.enabled:
+            with self._lock:
+                self._sessions.setdefault(upload_id, LiveSession(upload_id, user_id, admin_id))
+
+    def unregister(self, upload_id):
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+
+    def submit(self, upload_id, data):
+        # Offer an encoded frame; it is analyzed only if the session is due
+        # for a sample and the queue has room. Never blocks the caller.
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            now = time.monotonic()
+            if session is None or now - session.last_submitted < self.sample_interval:
+                return False
+            session.last_submitted = now
+        try:
+            self._queue.put_nowait((upload_id, bytes(data), now))
+            return True
+        except queue.Full:
+            self.frames_dropped += 1
+            return False
+
+    def flags(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            return dict(session.flags) if session and session.flags else None
+
+    def sessions_for_admin(self, admin_id):
+        with self._lock:
+            return [
+                {'upload_id': s.upload_id, 'user_id': s.user_id, 'flags': s.flags, 'flag_counts': dict(s.flag_counts)}
+                for s in self._sessions.values() if s.admin_id == admin_id
+            ]
+
+    def stats(self):
+        with self._lock:
+            active = len(self._sessions)
+        return {
+            'enabled': self.enabled,
+            'active_sessions': active,
+            'queued_frames': self._queue.qsize(),
+            'batches': self.batches,
+            'frames_analyzed': self.frames_analyzed,
+            'frames_dropped': self.frames_dropped,
+            'mean_batch_size': self.frames_analyzed / self.batches if self.batches else 0.0,
+            'mean_latency': self.latency_total / self.frames_analyzed if self.frames_analyzed else 0.0,
+            'max_latency': self.latency_max
+        }
+
+    def _collect_batch(self):
+        # None in the queue wakes the thread up to stop
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = first[2] + self.latency_budget
+        while len(batch) < self.batch_size and not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _get_face_mesh(self):
+        if self._face_mesh is None:
+            import mediapipe as mp
+            # Frames from different students are interleaved, so each frame
+            # is processed on its own rather than tracked
+            self._face_mesh = mp.solutions.face_mesh.FaceMesh(
+                static_image_mode=True,
+                max_num_faces=2,
+                refine_landmarks=True,
+                min_detection_confidence=0.5)
+        return self._face_mesh
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect_batch()
+            try:
+                self._analyze(batch)
+            except Exception as e:
+                record_error('live_analysis', e)
+
+    def _analyze(self, batch):
+        import cv2
+        from face_tracking import FaceTracker
+        face_mesh = self._get_face_mesh()
+
+        upload_ids = []
+        submitted = []
+        face_counts = []
+        points = []
+        for upload_id, data, submitted_at in batch:
+            with self._lock:
+                session = self._sessions.get(upload_id)
+            if session is None:
+                continue
+            frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            if frame.shape[1] > LIVE_FRAME_WIDTH:
+                height = int(frame.shape[0] * LIVE_FRAME_WIDTH / frame.shape[1])
+                frame = cv2.resize(frame, (LIVE_FRAME_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+            results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            faces = results.multi_face_landmarks or []
+            # People are confirmed tracks of the faces FaceMesh finds, so a
+            # face missed or misdetected in one frame doesn't raise a flag.
+            # A session's frames are only analyzed on this thread.
+            if session.tracker is None:
+                session.tracker = FaceTracker(None, detect_interval=1)
+            people = session.tracker.update(frame, face_metrics.face_boxes(faces, frame.shape[1], frame.shape[0]))
+            upload_ids.append(upload_id)
+            submitted.append(submitted_at)
+            face_counts.append(len(people))
+            points.append(face_metrics.landmarks_to_array(faces[0].landmark) if faces else face_metrics.no_face_array())
+
+        if not upload_ids:
+            return
+
+        # Gaze for the whole batch at once
+        eyes_off = face_metrics.eyes_off_screen(np.stack(points))
+
+        now = time.monotonic()
+        with self._lock:
+            for upload_id, face_count, off in zip(upload_ids, face_counts, eyes_off.tolist()):
+                session = self._sessions.get(upload_id)
+                if session is None:
+                    continue
+                session.flags = {
+                    'no_face': face_count == 0,
+                    'multiple_faces': face_count > 1,
+                    'eyes_off_screen': bool(off) and face_count > 0,
+                    'face_count': face_count,
+                    'updated_at': time.time()
+                }
+                for flag in session.flag_counts:
+                    if session.flags[flag]:
+                        session.flag_counts[flag] += 1
+
+        self.batches += 1
+        self.frames_analyzed += len(upload_ids)
+        for submitted_at in submitted:
+            latency = now - submitted_at
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+
+live_service = LiveAnalysisService()
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, Boolean, DateTime, func
+from sqlalchemy import Column, Integer, BigInteger, String, LargeBinary, ForeignKey, Float, Boolean, DateTime, func, inspect, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import validates
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
 from datetime import datetime
 from database import *
 
@@ -35,17 +35,24 @@ class QuestionSet(Base):
     admin_id = Column(Integer, ForeignKey('admins.id'), nullable=False)
     admin = relationship('Admin', back_populates='question_sets')  # Define the relationship here
     questions = relationship('Question', back_populates='question_set')
+    video_profile = Column(String(20))  # Storage profile for recordings; None uses the server default
+    retention_days = Column(Integer)  # Recordings are deleted after this many days; None keeps them
+    face_detector = Column(String(20))  # Face detector backend for analysis; None uses the server default
+    # Bumped in the same transaction as any change to the set's questions or
+    # options; per-process caches compare it to see changes made elsewhere
+    content_version = Column(Integer, default=0)
     created_at = Column(DateTime, default=func.now())
     
     __table_args__ = (
         UniqueConstraint('name', 'admin_id', name='unique_question_set_admin'),
+        Index('ix_question_sets_admin_id_id', 'admin_id', 'id'),
     )
 
 class Question(Base):
     __tablename__ = 'questions'
     id = Column(Integer, primary_key=True)
     text = Column(String(500), nullable=False)
-    question_set_id = Column(Integer, ForeignKey('question_sets.id'), nullable=False)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), nullable=False, index=True)
     question_set = relationship('QuestionSet', back_populates='questions')  # Define the relationship here
     options = relationship('Option', back_populates='question')
     created_at = Column(DateTime, default=func.now())
@@ -56,7 +63,7 @@ class Option(Base):
     id = Column(Integer, primary_key=True)
     text = Column(String(200), nullable=False)
     is_correct = Column(Boolean, default=False)
-    question_id = Column(Integer, ForeignKey('questions.id'), nullable=False)
+    question_id = Column(Integer, ForeignKey('questions.id'), nullable=False, index=True)
     question = relationship('Question', back_populates='options')  # Define the relationship here
     created_at = Column(DateTime, default=func.now())
     user_answers = relationship('UserAnswer', back_populates='option')
@@ -81,18 +88,42 @@ class UserMetrics(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     admin_id = Column(Integer, ForeignKey('admins.id'), nullable=False)
+    video_recording_id = Column(Integer, ForeignKey('video_recordings.id'))  # Recording the metrics were computed from
     recording_duration = Column(Float, nullable=False)
     eyes_off_screen_duration = Column(Float, nullable=False)
     lips_moving_duration = Column(Float, nullable=False)
+    face_detector = Column(String(20))  # Backend the metrics were computed with
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index('ix_user_metrics_user_id', 'user_id'),
+        Index('ix_user_metrics_admin_id_user_id', 'admin_id', 'user_id'),
+        Index('ix_user_metrics_video_recording_id', 'video_recording_id', unique=True),
+    )
+
 class VideoRecording(Base):
     __tablename__ = 'video_recordings'
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     admin_id = Column(Integer, ForeignKey('admins.id'), nullable=False)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'))
     file_path = Column(String(255), nullable=False)
     recorded_at = Column(DateTime, default=func.now())
+    storage_status = Column(String(20), default='original')  # 'original', 'transcoded' or 'purged'
+    storage_profile = Column(String(20))
+    original_size = Column(BigInteger)  # Bytes as recorded
+    stored_size = Column(BigInteger)  # Bytes kept after transcoding
+    thumbnail_path = Column(String(255))
+    thumbnail_size = Column(Integer)
+    thumbnail_count = Column(Integer)
+    thumbnail_interval = Column(Float)  # Seconds of video per thumbnail tile
+    transcoded_at = Column(DateTime)
+    purged_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_video_recordings_admin_id_id', 'admin_id', 'id'),
+        Index('ix_video_recordings_question_set_id_id', 'question_set_id', 'id'),
+    )
 
 class UserAnswer(Base):
     __tablename__ = 'user_answers'
@@ -102,8 +133,138 @@ class UserAnswer(Base):
     option_id = Column(Integer, ForeignKey('options.id'), nullable=False)
     is_correct = Column(Boolean, default=False)  # Indicates whether the user's answer is correct
     marks_obtained = Column(Float)  # New column to store marks obtained
+    attempt_id = Column(Integer, ForeignKey('exam_attempts.id'))  # None for answers stored before attempts existed
     created_at = Column(DateTime, default=func.now())
 
     user = relationship('User', back_populates='answers')  # Define the relationship to User
     question = relationship('Question', back_populates='user_answers')  # Define the relationship to Question
     option = relationship('Option', back_populates='user_answers')  
+
+    __table_args__ = (
+        Index('ix_user_answers_user_id_question_id', 'user_id', 'question_id'),
+        Index('ix_user_answers_question_id', 'question_id'),
+        # A retried submit can't store an attempt's answers twice
+        Index('ix_user_answers_attempt_id_question_id', 'attempt_id', 'question_id', unique=True),
+    )
+
+class VideoUpload(Base):
+    __tablename__ = 'video_uploads'
+    id = Column(String(32), primary_key=True)  # Opaque upload id handed to the client
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    admin_id = Column(Integer, ForeignKey('admins.id'), nullable=False)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), nullable=False)
+    file_path = Column(String(255), nullable=False)
+    mode = Column(String(20), default='chunks')  # 'chunks' (client-encoded file) or 'frames' (server-encoded images)
+    status = Column(String(20), default='open')  # 'open' or 'finalized'
+    video_recording_id = Column(Integer, ForeignKey('video_recordings.id'))
+    created_at = Column(DateTime, default=func.now())
+    finalized_at = Column(DateTime)
+
+class RecordingTimeline(Base):
+    # Run-length encoded proctoring signals of a recording (see timeline.py)
+    __tablename__ = 'recording_timelines'
+    video_recording_id = Column(Integer, ForeignKey('video_recordings.id'), primary_key=True)
+    fps = Column(Float, nullable=False)
+    frame_count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+class AnalysisJob(Base):
+    __tablename__ = 'analysis_jobs'
+    id = Column(Integer, primary_key=True)
+    video_recording_id = Column(Integer, ForeignKey('video_recordings.id'), nullable=False, index=True)
+    kind = Column(String(20), default='analyze')  # 'analyze' or 'transcode'
+    status = Column(String(20), default='pending', index=True)  # 'pending', 'running', 'done' or 'failed'
+    attempts = Column(Integer, default=0)
+    worker = Column(String(100))  # Worker that last claimed the job
+    error = Column(String(500))
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+# Score summaries, maintained incrementally by each submission so results
+# can be read without scanning user_answers
+class AttemptResult(Base):
+    __tablename__ = 'attempt_results'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), nullable=False)
+    answered = Column(Integer, nullable=False)
+    correct = Column(Integer, nullable=False)
+    total_marks = Column(Float, nullable=False)
+    max_marks = Column(Float, nullable=False)  # Questions in the set at submission time
+    submitted_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index('ix_attempt_results_question_set_id_id', 'question_set_id', 'id'),
+        Index('ix_attempt_results_user_id_question_set_id', 'user_id', 'question_set_id'),
+    )
+
+class ExamAttempt(Base):
+    __tablename__ = 'exam_attempts'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), nullable=False)
+    status = Column(String(20), default='in_progress', nullable=False)  # 'in_progress' or 'submitted'
+    # 1 while in progress and NULL once submitted. NULLs never collide in a
+    # unique index, so this allows one open attempt per user and test.
+    active = Column(Integer, default=1)
+    result_id = Column(Integer, ForeignKey('attempt_results.id'))
+    started_at = Column(DateTime, default=func.now())
+    submitted_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_exam_attempts_user_id_question_set_id_active', 'user_id', 'question_set_id', 'active', unique=True),
+    )
+
+class AttemptAnswer(Base):
+    # Latest autosaved choice per question of an attempt
+    __tablename__ = 'attempt_answers'
+    attempt_id = Column(Integer, ForeignKey('exam_attempts.id'), primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id'), primary_key=True)
+    option_id = Column(Integer, ForeignKey('options.id'), nullable=False)
+    saved_at = Column(DateTime, nullable=False)
+
+class QuestionSetResult(Base):
+    __tablename__ = 'question_set_results'
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), primary_key=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    total_marks_sum = Column(Float, default=0.0, nullable=False)
+    total_marks_sq_sum = Column(Float, default=0.0, nullable=False)  # For the standard deviation
+    score_percent_sum = Column(Float, default=0.0, nullable=False)
+    best_marks = Column(Float)
+    worst_marks = Column(Float)
+
+class ScoreBucket(Base):
+    # Attempts per score band of a question set; band b covers scores from
+    # b * 10% up to (b + 1) * 10%, and the last band includes full marks
+    __tablename__ = 'score_buckets'
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+class QuestionResult(Base):
+    __tablename__ = 'question_results'
+    question_id = Column(Integer, ForeignKey('questions.id'), primary_key=True)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id'), nullable=False, index=True)
+    answers = Column(Integer, default=0, nullable=False)
+    correct = Column(Integer, default=0, nullable=False)
+
+
+def create_schema(bind):
+    # create_all skips tables that already exist, so columns and indexes
+    # added to an existing table are created here as well. Added columns are
+    # nullable and existing rows get NULL.
+    Base.metadata.create_all(bind)
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
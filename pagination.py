@@ -0,0 +1,42 @@
+from flask import request
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PaginationError(Exception):
+    pass
+
+
+def page_args():
+    # Reads ?limit= and ?cursor= from the request. The cursor is the id of the
+    # last row of the previous page.
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        raise PaginationError('Invalid limit or cursor')
+    if limit < 1:
+        raise PaginationError('Invalid limit or cursor')
+    return min(limit, MAX_PAGE_SIZE), cursor
+
+
+def keyset_page(query, id_column, limit, cursor=None):
+    # Fetch one page ordered by id using WHERE id > cursor instead of OFFSET,
+    # so every page costs an index range scan. Returns (rows, next_cursor).
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1].id)
+    return rows, next_cursor
+
+
+def with_next_cursor(response, next_cursor):
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
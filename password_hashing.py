@@ -0,0 +1,147 @@
+import os
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# PBKDF2 work factor; stored hashes with other parameters are upgraded on login
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600000))
+PASSWORD_HASH_METHOD = f'pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}'
+# Processes that hash passwords; 0 hashes on the request thread instead
+PASSWORD_HASH_PROCESSES = int(os.environ.get('PASSWORD_HASH_PROCESSES', max(1, (os.cpu_count() or 2) // 2)))
+# Hashes queued or running at once; further requests are turned away
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 256))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 30))
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def needs_rehash(password_hash, method=PASSWORD_HASH_METHOD):
+    return password_hash.split('$', 1)[0] != method
+
+
+# Run in the pool processes. Each returns its start time so the caller can
+# tell queue wait from hashing time.
+def _hash(password, method):
+    started = time.time()
+    return started, generate_password_hash(password, method=method)
+
+
+def _verify(password_hash, password, method):
+    # A correct password with outdated parameters is rehashed right away,
+    # while the plain text is at hand
+    started = time.time()
+    ok = check_password_hash(password_hash, password)
+    new_hash = generate_password_hash(password, method=method) if ok and needs_rehash(password_hash, method) else None
+    return started, ok, new_hash
+
+
+class PasswordHasher:
+    # Runs hashing on a bounded process pool so logins at exam start can't
+    # starve the request threads of CPU
+    def __init__(self, processes=PASSWORD_HASH_PROCESSES, queue_limit=PASSWORD_HASH_QUEUE_LIMIT,
+                 timeout=PASSWORD_HASH_TIMEOUT, method=PASSWORD_HASH_METHOD):
+        self.processes = processes
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.method = method
+        self._pool = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.hash_time_total = 0.0
+        self.hash_time_max = 0.0
+        self.observers = []  # Called with (operation, queue_wait, hash_time)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Created on first use, so each server worker process gets
+                # its own pool after the server has forked it. By then the
+                # process runs background and request threads, and forking
+                # it could copy a lock one of them holds, so the pool's
+                # processes start from a fork server (or are spawned where
+                # there is none) instead.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            return self._pool
+
+    def _run(self, operation, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.queue_limit:
+                self.rejected += 1
+                raise HashingBusy('Too many password checks in progress')
+            self.in_flight += 1
+
+        submitted = time.time()
+        try:
+            if self.processes > 0:
+                future = self._get_pool().submit(fn, *args)
+                try:
+                    result = future.result(timeout=self.timeout)
+                except FutureTimeout:
+                    future.cancel()
+                    raise HashingBusy('Password check timed out')
+            else:
+                result = fn(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        finished = time.time()
+        queue_wait = max(result[0] - submitted, 0.0)
+        hash_time = max(finished - result[0], 0.0)
+        with self._lock:
+            self.completed += 1
+            self.queue_wait_total += queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+            self.hash_time_total += hash_time
+            self.hash_time_max = max(self.hash_time_max, hash_time)
+        for observer in self.observers:
+            observer(operation, queue_wait, hash_time)
+        return result[1:]
+
+    def hash(self, password):
+        return self._run('hash', _hash, password, self.method)[0]
+
+    def verify(self, password_hash, password):
+        # Returns (ok, new_hash); new_hash is set when the stored hash
+        # should be replaced
+        ok, new_hash = self._run('verify', _verify, password_hash, password, self.method)
+        if new_hash:
+            with self._lock:
+                self.rehashed += 1
+        return ok, new_hash
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'processes': self.processes,
+                'queue_limit': self.queue_limit,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'queue_wait_mean': self.queue_wait_total / self.completed if self.completed else 0.0,
+                'queue_wait_max': self.queue_wait_max,
+                'hash_time_mean': self.hash_time_total / self.completed if self.completed else 0.0,
+                'hash_time_max': self.hash_time_max
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from models import Question
+from invalidation import on_question_set_changed, question_set_version
+
+
+class QuestionSetPayload:
+    # Serialized questions/options for one set, encoded once and shared by
+    # every request until the set changes.
+    def __init__(self, body, version):
+        self.body = body
+        self.version = version
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+_payloads = {}
+_payload_lock = threading.Lock()
+
+
+def _load_payload(session, question_set_id, version):
+    # Questions and their options in one joined query
+    questions = session.execute(
+        select(Question)
+        .options(joinedload(Question.options))
+        .where(Question.question_set_id == question_set_id)
+        .order_by(Question.id)
+    ).unique().scalars().all()
+
+    questions_data = []
+    for question in questions:
+        options = [{'option_id': option.id, 'text': option.text, 'is_correct': option.is_correct}
+                   for option in sorted(question.options, key=lambda o: o.id)]
+        questions_data.append({'question_id': question.id, 'text': question.text, 'options': options})
+
+    body = current_app.json.dumps(questions_data).encode('utf-8')
+    return QuestionSetPayload(body, version)
+
+
+def get_question_set_payload(session, question_set_id):
+    # Returns None if the question set does not exist. The cached payload is
+    # used while the set's content version is unchanged, so a change made by
+    # another process is picked up by the next request.
+    version = question_set_version(session, question_set_id)
+    if version is None:
+        return None
+    with _payload_lock:
+        payload = _payloads.get(question_set_id)
+    if payload is not None and payload.version == version:
+        return payload
+
+    # The version is read before the questions, so a change committed in
+    # between leaves a payload tagged older than it is and it is reloaded
+    payload = _load_payload(session, question_set_id, version)
+    with _payload_lock:
+        _payloads[question_set_id] = payload
+    return payload
+
+
+def invalidate_question_set_payload(question_set_id):
+    with _payload_lock:
+        _payloads.pop(question_set_id, None)
+
+
+on_question_set_changed(invalidate_question_set_payload)
@@ -0,0 +1,143 @@
+import argparse
+import codecs
+import csv
+import json
+import sys
+from itertools import islice
+from sqlalchemy import insert
+from models import Question, Option, QuestionSet
+from invalidation import mark_question_set_changed
+
+IMPORT_BATCH_SIZE = 500  # Questions inserted and committed per batch
+IMPORT_FORMATS = ('jsonl', 'csv')
+
+
+class QuestionImportError(Exception):
+    def __init__(self, message, imported=0):
+        super().__init__(message)
+        self.imported = imported  # Questions already committed before the error
+
+
+def bulk_create_questions(session, question_set_id, questions):
+    # Insert a list of {'text', 'options': [{'text', 'is_correct'}]} dicts with
+    # one set-based INSERT for the questions and one for all their options.
+    # Question IDs come back from RETURNING in parameter order.
+    if not questions:
+        return []
+
+    question_ids = session.execute(
+        insert(Question).returning(Question.id, sort_by_parameter_order=True),
+        [{'text': q.get('text'), 'question_set_id': question_set_id} for q in questions]
+    ).scalars().all()
+
+    option_rows = [
+        {'text': o.get('text'), 'is_correct': bool(o.get('is_correct')), 'question_id': question_id}
+        for question_id, q in zip(question_ids, questions)
+        for o in q.get('options') or []
+    ]
+    if option_rows:
+        session.execute(insert(Option), option_rows)
+
+    mark_question_set_changed(session, question_set_id)
+    return question_ids
+
+
+def _parse_bool(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'x')
+
+
+def iter_jsonl_questions(lines):
+    # One question per line: {"text": ..., "options": [{"text": ..., "is_correct": ...}]}
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            question = json.loads(line)
+        except ValueError as e:
+            raise QuestionImportError(f'Line {line_number}: invalid JSON ({e})')
+        if not isinstance(question, dict):
+            raise QuestionImportError(f'Line {line_number}: expected a JSON object')
+        options = question.get('options')
+        if options is not None and not (isinstance(options, list) and all(isinstance(o, dict) for o in options)):
+            raise QuestionImportError(f'Line {line_number}: options must be a list of objects')
+        if not question.get('text'):
+            raise QuestionImportError(f'Line {line_number}: missing question text')
+        yield question
+
+
+def iter_csv_questions(lines):
+    # Header row with question,option,is_correct. A row with a question starts
+    # a new question; rows with an empty question add options to the previous one.
+    reader = csv.DictReader(lines)
+    missing = {'question', 'option', 'is_correct'} - set(reader.fieldnames or ())
+    if missing:
+        raise QuestionImportError(f'Missing CSV columns: {", ".join(sorted(missing))}')
+
+    question = None
+    for row in reader:
+        if row['question']:
+            if question:
+                yield question
+            question = {'text': row['question'], 'options': []}
+        elif question is None:
+            raise QuestionImportError(f'Line {reader.line_num}: option without a question')
+        if row['option']:
+            question['options'].append({'text': row['option'], 'is_correct': _parse_bool(row['is_correct'])})
+    if question:
+        yield question
+
+
+def iter_questions(lines, fmt):
+    if fmt == 'jsonl':
+        return iter_jsonl_questions(lines)
+    if fmt == 'csv':
+        return iter_csv_questions(lines)
+    raise QuestionImportError(f'Unsupported import format {fmt}')
+
+
+def import_questions(session, question_set_id, questions, batch_size=IMPORT_BATCH_SIZE):
+    # Stream questions into a set in committed batches, so memory and
+    # transaction length stay bounded for banks of any size. Returns the
+    # number of questions imported.
+    imported = 0
+    questions = iter(questions)
+    while True:
+        try:
+            batch = list(islice(questions, batch_size))
+        except QuestionImportError as e:
+            e.imported = imported
+            raise
+        if not batch:
+            return imported
+        bulk_create_questions(session, question_set_id, batch)
+        session.commit()
+        imported += len(batch)
+
+
+def decode_lines(stream, encoding='utf-8'):
+    # Text lines from a binary stream (e.g. a request body), read incrementally
+    return codecs.iterdecode(stream, encoding)
+
+
+if __name__ == '__main__':
+    from database import Session
+
+    parser = argparse.ArgumentParser(description='Import a CSV or JSONL question bank into a test.')
+    parser.add_argument('path', help="Question bank file, or '-' for stdin")
+    parser.add_argument('--test-id', type=int, required=True)
+    parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or args.path.rsplit('.', 1)[-1].lower()
+    source = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+
+    with source, Session() as session:
+        if not session.get(QuestionSet, args.test_id):
+            sys.exit(f'Test {args.test_id} not found')
+        try:
+            count = import_questions(session, args.test_id, iter_questions(source, fmt), args.batch_size)
+        except QuestionImportError as e:
+            sys.exit(f'{e} ({e.imported} questions imported before the error)')
+    print(f'Imported {count} questions into test {args.test_id}')
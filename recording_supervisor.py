@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from video_writer import StreamingVideoWriter
+from instrumentation import record_error
+
+MAX_ACTIVE_RECORDINGS = int(os.environ.get('MAX_ACTIVE_RECORDINGS', 200))  # Per node
+RECORDING_WRITER_THREADS = int(os.environ.get('RECORDING_WRITER_THREADS', min(32, (os.cpu_count() or 1) * 2)))
+# A recording with no activity for this long is treated as abandoned
+RECORDING_IDLE_TIMEOUT = float(os.environ.get('RECORDING_IDLE_TIMEOUT', 600))
+# Exam time limit; recordings still running after this are stopped
+RECORDING_MAX_DURATION = float(os.environ.get('RECORDING_MAX_DURATION', 4 * 60 * 60))
+REAP_INTERVAL = 30  # Seconds between reaper passes
+
+
+class SupervisorFull(Exception):
+    pass
+
+
+class RecordingSession:
+    def __init__(self, upload_id, writer):
+        self.upload_id = upload_id
+        self.writer = writer
+        self.started_at = time.monotonic()
+        self.last_activity = self.started_at
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+
+class RecordingSupervisor:
+    # Owns every server-encoded recording on this node: caps how many run at
+    # once, runs their writers on one shared thread pool, stops them on submit
+    # or timeout and reaps the ones students abandoned.
+    def __init__(self, max_active=MAX_ACTIVE_RECORDINGS, writer_threads=RECORDING_WRITER_THREADS,
+                 idle_timeout=RECORDING_IDLE_TIMEOUT, max_duration=RECORDING_MAX_DURATION):
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.max_duration = max_duration
+        self._executor = ThreadPoolExecutor(max_workers=writer_threads, thread_name_prefix='video-writer')
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stopping = threading.Event()
+        self.started = 0
+        self.stopped = 0
+        self.reaped = 0
+        self.rejected = 0
+
+    def start_session(self, upload_id, path, **writer_kwargs):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is not None:
+                return session.writer
+            if len(self._sessions) >= self.max_active:
+                self.rejected += 1
+                raise SupervisorFull('Too many active recordings on this server')
+            writer = StreamingVideoWriter(path, self._executor, **writer_kwargs)
+            self._sessions[upload_id] = RecordingSession(upload_id, writer)
+            self.started += 1
+            return writer
+
+    def get_writer(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None:
+            return None
+        session.touch()
+        return session.writer
+
+    def is_active(self, upload_id):
+        with self._lock:
+            return upload_id in self._sessions
+
+    def stop_session(self, upload_id, timeout=None):
+        # Flush and close the session's writer. Returns the writer, or None
+        # if the session is not running here.
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        if session is None:
+            return None
+        session.writer.close(timeout)
+        with self._lock:
+            self.stopped += 1
+        return session.writer
+
+    def expired_sessions(self):
+        # Upload ids of sessions that went idle or ran past the time limit
+        now = time.monotonic()
+        with self._lock:
+            return [
+                upload_id for upload_id, session in self._sessions.items()
+                if now - session.last_activity > self.idle_timeout or now - session.started_at > self.max_duration
+            ]
+
+    def start_reaper(self, reap, interval=REAP_INTERVAL):
+        # Calls reap() every `interval` seconds on a daemon thread; reap
+        # returns how many sessions it cleaned up
+        if self._reaper is not None:
+            return
+
+        def run():
+            while not self._stopping.wait(interval):
+                try:
+                    reaped = reap()
+                    with self._lock:
+                        self.reaped += reaped
+                except Exception as e:
+                    record_error('recording_reaper', e)
+
+        self._reaper = threading.Thread(target=run, name='recording-reaper', daemon=True)
+        self._reaper.start()
+
+    def shutdown(self, timeout=10):
+        # Stop the reaper, flush every open recording and release the pool
+        self._stopping.set()
+        with self._lock:
+            upload_ids = list(self._sessions)
+        for upload_id in upload_ids:
+            self.stop_session(upload_id, timeout)
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            stats = {
+                'active': len(sessions),
+                'max_active': self.max_active,
+                'started': self.started,
+                'stopped': self.stopped,
+                'reaped': self.reaped,
+                'rejected': self.rejected
+            }
+        stats['pending_frames'] = sum(session.writer.pending for session in sessions)
+        return stats
+
+
+supervisor = RecordingSupervisor()
@@ -0,0 +1,153 @@
+import math
+import numpy as np
+from sqlalchemy import select, insert, update, case, or_, bindparam
+from sqlalchemy.exc import IntegrityError
+from models import Question, AttemptResult, QuestionSetResult, ScoreBucket, QuestionResult
+
+SCORE_BUCKETS = 10  # 10% score bands
+
+
+def _ensure_result_rows(session, question_set_id, question_ids):
+    # Summary rows are created the first time they're needed so every later
+    # update is a single atomic UPDATE. Two submissions racing to create them
+    # is fine: the loser's savepoint rolls back and it checks again.
+    for _ in range(3):
+        has_set = session.execute(
+            select(QuestionSetResult.question_set_id).where(QuestionSetResult.question_set_id == question_set_id)
+        ).first() is not None
+        existing = set(session.execute(
+            select(QuestionResult.question_id).where(QuestionResult.question_id.in_(question_ids))
+        ).scalars())
+        missing = [q for q in question_ids if q not in existing]
+        if has_set and not missing:
+            return
+
+        try:
+            with session.begin_nested():
+                if not has_set:
+                    session.execute(insert(QuestionSetResult), [{'question_set_id': question_set_id}])
+                    session.execute(insert(ScoreBucket), [
+                        {'question_set_id': question_set_id, 'bucket': b} for b in range(SCORE_BUCKETS)
+                    ])
+                if missing:
+                    session.execute(insert(QuestionResult), [
+                        {'question_id': q, 'question_set_id': question_set_id} for q in missing
+                    ])
+            return
+        except IntegrityError:
+            continue
+    raise RuntimeError('Could not create result summary rows')
+
+
+def record_attempt(session, user_id, question_set_id, max_marks, question_ids, is_correct):
+    # Add one graded submission to the per-attempt, per-set and per-question
+    # summaries. Runs in the submission's transaction, so the summaries
+    # commit or roll back together with the answers.
+    total_marks = float(is_correct.sum())
+    attempt = AttemptResult(
+        user_id=user_id,
+        question_set_id=question_set_id,
+        answered=len(question_ids),
+        correct=int(is_correct.sum()),
+        total_marks=total_marks,
+        max_marks=float(max_marks)
+    )
+    session.add(attempt)
+
+    answered_ids, inverse = np.unique(question_ids, return_inverse=True)
+    answers = np.bincount(inverse)
+    correct = np.bincount(inverse, weights=is_correct.astype(np.float64)).astype(np.int64)
+    _ensure_result_rows(session, question_set_id, answered_ids.tolist())
+
+    fraction = total_marks / max_marks if max_marks else 0.0
+    bucket = min(int(fraction * SCORE_BUCKETS), SCORE_BUCKETS - 1)
+    session.execute(
+        update(QuestionSetResult)
+        .where(QuestionSetResult.question_set_id == question_set_id)
+        .values(
+            attempts=QuestionSetResult.attempts + 1,
+            total_marks_sum=QuestionSetResult.total_marks_sum + total_marks,
+            total_marks_sq_sum=QuestionSetResult.total_marks_sq_sum + total_marks * total_marks,
+            score_percent_sum=QuestionSetResult.score_percent_sum + fraction * 100,
+            best_marks=case(
+                (or_(QuestionSetResult.best_marks.is_(None), QuestionSetResult.best_marks < total_marks), total_marks),
+                else_=QuestionSetResult.best_marks),
+            worst_marks=case(
+                (or_(QuestionSetResult.worst_marks.is_(None), QuestionSetResult.worst_marks > total_marks), total_marks),
+                else_=QuestionSetResult.worst_marks)
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    session.execute(
+        update(ScoreBucket)
+        .where(ScoreBucket.question_set_id == question_set_id, ScoreBucket.bucket == bucket)
+        .values(count=ScoreBucket.count + 1),
+        execution_options={'synchronize_session': False}
+    )
+
+    # One executemany for all the questions in the submission
+    question_results = QuestionResult.__table__
+    if len(answered_ids):
+        session.connection().execute(
+            question_results.update()
+            .where(question_results.c.question_id == bindparam('b_question_id'))
+            .values(answers=question_results.c.answers + bindparam('b_answers'),
+                    correct=question_results.c.correct + bindparam('b_correct')),
+            [
+                {'b_question_id': q, 'b_answers': a, 'b_correct': c}
+                for q, a, c in zip(answered_ids.tolist(), answers.tolist(), correct.tolist())
+            ]
+        )
+
+    session.flush()
+    return attempt
+
+
+def question_set_summary(session, question_set_id):
+    # Results of a question set from the summary tables; cost depends on the
+    # number of questions, not on the number of submissions
+    result = session.get(QuestionSetResult, question_set_id)
+    buckets = session.execute(
+        select(ScoreBucket.bucket, ScoreBucket.count)
+        .where(ScoreBucket.question_set_id == question_set_id)
+        .order_by(ScoreBucket.bucket)
+    ).all()
+    questions = session.execute(
+        select(Question.id, Question.text, QuestionResult.answers, QuestionResult.correct)
+        .outerjoin(QuestionResult, QuestionResult.question_id == Question.id)
+        .where(Question.question_set_id == question_set_id)
+        .order_by(Question.id)
+    ).all()
+
+    attempts = result.attempts if result else 0
+    mean = result.total_marks_sum / attempts if attempts else None
+    stddev = None
+    if attempts:
+        # Guard against tiny negative variances from float rounding
+        stddev = math.sqrt(max(result.total_marks_sq_sum / attempts - mean * mean, 0.0))
+
+    counts = dict(buckets)
+    return {
+        'question_set_id': question_set_id,
+        'attempts': attempts,
+        'mean_marks': mean,
+        'stddev_marks': stddev,
+        'mean_score_percent': result.score_percent_sum / attempts if attempts else None,
+        'best_marks': result.best_marks if result else None,
+        'worst_marks': result.worst_marks if result else None,
+        'distribution': [
+            {'from_percent': b * 100 // SCORE_BUCKETS, 'to_percent': (b + 1) * 100 // SCORE_BUCKETS, 'attempts': counts.get(b, 0)}
+            for b in range(SCORE_BUCKETS)
+        ],
+        # Share of answers that were correct; lower means harder
+        'questions': [
+            {
+                'question_id': question_id,
+                'question_text': text,
+                'answers': answers or 0,
+                'correct': correct or 0,
+                'correct_rate': correct / answers if answers else None
+            }
+            for question_id, text, answers, correct in questions
+        ]
+    }
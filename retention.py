@@ -0,0 +1,41 @@
+import os
+from datetime import datetime, timedelta
+from models import QuestionSet, VideoRecording
+from video_profiles import DEFAULT_VIDEO_PROFILE
+
+
+def video_profile_for(session, video):
+    # Storage profile of the recording's test, or the server default
+    if video.question_set_id is not None:
+        question_set = session.get(QuestionSet, video.question_set_id)
+        if question_set is not None and question_set.video_profile:
+            return question_set.video_profile
+    return DEFAULT_VIDEO_PROFILE
+
+
+def purge_expired_recordings(session, now=None):
+    # Delete the files of recordings older than their test's retention
+    # period. Rows, metrics and answers are kept; only the video and its
+    # thumbnails go. Returns how many recordings were purged.
+    now = now or datetime.utcnow()
+    purged = 0
+    policies = session.query(QuestionSet.id, QuestionSet.retention_days).filter(QuestionSet.retention_days.isnot(None)).all()
+    for question_set_id, retention_days in policies:
+        cutoff = now - timedelta(days=retention_days)
+        expired = session.query(VideoRecording).filter(
+            VideoRecording.question_set_id == question_set_id,
+            VideoRecording.recorded_at < cutoff,
+            VideoRecording.purged_at.is_(None)
+        ).all()
+        for video in expired:
+            for path in (video.file_path, video.thumbnail_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            video.storage_status = 'purged'
+            video.stored_size = 0
+            video.thumbnail_path = None
+            video.thumbnail_size = None
+            video.purged_at = now
+            purged += 1
+        session.commit()
+    return purged
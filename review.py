@@ -0,0 +1,88 @@
+import os
+from flask import url_for
+from sqlalchemy import select, and_, or_
+from models import VideoRecording, UserMetrics, AnalysisJob
+from video_profiles import THUMBNAIL_COLUMNS, THUMBNAIL_WIDTH
+
+# A recording is flagged for review when the student spent more than these
+# shares of it looking away or talking
+FLAG_EYES_OFF_RATIO = float(os.environ.get('FLAG_EYES_OFF_RATIO', 0.2))
+FLAG_LIPS_MOVING_RATIO = float(os.environ.get('FLAG_LIPS_MOVING_RATIO', 0.2))
+MAX_BATCH_IDS = 200
+
+
+def flagged_condition():
+    return and_(
+        UserMetrics.recording_duration > 0,
+        or_(
+            UserMetrics.eyes_off_screen_duration > FLAG_EYES_OFF_RATIO * UserMetrics.recording_duration,
+            UserMetrics.lips_moving_duration > FLAG_LIPS_MOVING_RATIO * UserMetrics.recording_duration
+        )
+    )
+
+
+def analysis_status_column():
+    # Status of the latest analysis job of each video, as a correlated
+    # subquery so it comes back with the video row
+    return (
+        select(AnalysisJob.status)
+        .where(AnalysisJob.video_recording_id == VideoRecording.id,
+               or_(AnalysisJob.kind == 'analyze', AnalysisJob.kind.is_(None)))
+        .order_by(AnalysisJob.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def video_details_query(session):
+    # Videos with their metrics and analysis status in one query. Rows are
+    # (VideoRecording, UserMetrics or None, status or None).
+    return (
+        session.query(VideoRecording, UserMetrics, analysis_status_column())
+        .outerjoin(UserMetrics, UserMetrics.video_recording_id == VideoRecording.id)
+    )
+
+
+def _flags(metrics):
+    if metrics is None or not metrics.recording_duration:
+        return []
+    flags = []
+    if metrics.eyes_off_screen_duration > FLAG_EYES_OFF_RATIO * metrics.recording_duration:
+        flags.append('eyes_off_screen')
+    if metrics.lips_moving_duration > FLAG_LIPS_MOVING_RATIO * metrics.recording_duration:
+        flags.append('lips_moving')
+    return flags
+
+
+def video_details(video, metrics, analysis_status):
+    return {
+        'video_id': video.id,
+        'user_id': video.user_id,
+        'test_id': video.question_set_id,
+        'video_link': video.file_path,
+        'stream_url': url_for('admin.stream_student_video', video_id=video.id),
+        'recorded_at': video.recorded_at.isoformat() if video.recorded_at else None,
+        'analysis_status': analysis_status,
+        'storage': {
+            'status': video.storage_status,
+            'profile': video.storage_profile,
+            'original_size': video.original_size,
+            'stored_size': video.stored_size,
+            'thumbnail_size': video.thumbnail_size
+        },
+        # Tile k of the strip shows the video at k * interval seconds
+        'thumbnails': {
+            'url': url_for('admin.student_video_thumbnails', video_id=video.id),
+            'count': video.thumbnail_count,
+            'interval': video.thumbnail_interval,
+            'columns': min(THUMBNAIL_COLUMNS, video.thumbnail_count),
+            'tile_width': THUMBNAIL_WIDTH
+        } if video.thumbnail_path else None,
+        'metrics': {
+            'recording_duration': metrics.recording_duration,
+            'eyes_off_screen_duration': metrics.eyes_off_screen_duration,
+            'lips_moving_duration': metrics.lips_moving_duration,
+            'face_detector': metrics.face_detector
+        } if metrics else None,
+        'flags': _flags(metrics)
+    }
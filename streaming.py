@@ -0,0 +1,31 @@
+import mimetypes
+import os
+from flask import current_app, send_file
+
+# Recordings don't change once finalized, but they belong to one student:
+# browsers may cache them, shared proxies and CDNs must not
+VIDEO_CACHE_MAX_AGE = 3600
+
+
+def send_recording(file_path):
+    # Serve a recording without reading it into Python. Returns None if the
+    # file is missing.
+    #   - VIDEO_ACCEL_REDIRECT_PREFIX set: nginx serves the file (and Range
+    #     requests) from that internal location via X-Accel-Redirect.
+    #   - USE_X_SENDFILE set: Flask hands the path to Apache/lighttpd.
+    #   - Otherwise the WSGI server's file_wrapper streams it (sendfile on
+    #     gunicorn) and Werkzeug answers Range and conditional requests.
+    path = os.path.abspath(file_path)
+    if not os.path.isfile(path):
+        return None
+
+    accel_prefix = current_app.config.get('VIDEO_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        response = current_app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + os.path.basename(path)
+    else:
+        response = send_file(path, conditional=True, etag=True, max_age=VIDEO_CACHE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = VIDEO_CACHE_MAX_AGE
+    return response
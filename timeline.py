@@ -0,0 +1,98 @@
+import io
+import numpy as np
+
+# Signals kept on a recording's timeline. Each is stored as runs of frames
+# where it differs from normal: eyes off screen, lips moving, or a face
+# count other than one.
+SIGNALS = ('eyes_off_screen', 'lips_moving', 'face_count')
+NORMAL_VALUES = {'eyes_off_screen': 0, 'lips_moving': 0, 'face_count': 1}
+
+# Flags reported by range queries, as (signal, test on the run value)
+FLAGS = {
+    'eyes_off_screen': ('eyes_off_screen', lambda values: values > 0),
+    'lips_moving': ('lips_moving', lambda values: values > 0),
+    'no_face': ('face_count', lambda values: values == 0),
+    'multiple_faces': ('face_count', lambda values: values > 1)
+}
+
+
+class RunBuilder:
+    # Turns contiguous frame spans with one value each into runs of equal
+    # value, merging across calls. Spans with the normal value are dropped.
+    def __init__(self, normal):
+        self.normal = normal
+        self.runs = []  # [start, end, value], end exclusive
+
+    def add(self, starts, ends, values):
+        if not len(starts):
+            return
+        # A new run begins wherever the value changes
+        breaks = np.flatnonzero(np.diff(values)) + 1
+        run_starts = np.concatenate(([0], breaks))
+        run_ends = np.concatenate((breaks, [len(values)])) - 1
+        for first, last in zip(run_starts.tolist(), run_ends.tolist()):
+            value = int(values[first])
+            if value == self.normal:
+                continue
+            start, end = int(starts[first]), int(ends[last])
+            if self.runs and self.runs[-1][1] == start and self.runs[-1][2] == value:
+                self.runs[-1][1] = end
+            else:
+                self.runs.append([start, end, value])
+
+    def to_array(self):
+        return np.asarray(self.runs, dtype=np.int32).reshape(-1, 3)
+
+
+class Timeline:
+    # Run-length encoded proctoring signals of one recording. A two-hour
+    # exam takes a few kilobytes instead of one row per frame.
+    def __init__(self, fps, frame_count, runs):
+        self.fps = float(fps)
+        self.frame_count = int(frame_count)
+        self.runs = runs  # signal -> int32 array of (start, end, value) rows
+
+    @classmethod
+    def from_builders(cls, fps, frame_count, builders):
+        return cls(fps, frame_count, {signal: builders[signal].to_array() for signal in SIGNALS})
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, meta=np.asarray([self.fps, self.frame_count], dtype=np.float64), **self.runs)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            fps, frame_count = arrays['meta'].tolist()
+            return cls(fps, frame_count, {signal: arrays[signal] for signal in SIGNALS})
+
+    @property
+    def duration(self):
+        return self.frame_count / self.fps
+
+    def flag_runs(self, flag):
+        signal, test = FLAGS[flag]
+        runs = self.runs[signal]
+        return runs[test(runs[:, 2])]
+
+    def flag_duration(self, flag):
+        # Seconds the flag was raised over the whole recording
+        runs = self.flag_runs(flag)
+        return float((runs[:, 1] - runs[:, 0]).sum()) / self.fps
+
+    def intervals(self, flag, start=0.0, end=None, min_duration=0.0):
+        # (start, end) seconds of the flag's runs overlapping [start, end),
+        # clipped to the range. Runs are sorted and disjoint, so the range is
+        # found with two binary searches.
+        runs = self.flag_runs(flag)
+        start_frame = max(int(start * self.fps), 0)
+        end_frame = self.frame_count if end is None else min(int(np.ceil(end * self.fps)), self.frame_count)
+        first = np.searchsorted(runs[:, 1], start_frame, side='right')
+        last = np.searchsorted(runs[:, 0], end_frame, side='left')
+        selected = runs[first:last]
+
+        starts = np.maximum(selected[:, 0], start_frame) / self.fps
+        ends = np.minimum(selected[:, 1], end_frame) / self.fps
+        keep = ends - starts >= min_duration
+        return np.stack((starts[keep], ends[keep]), axis=1)
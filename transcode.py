@@ -0,0 +1,112 @@
+import os
+import cv2
+import numpy as np
+from video_profiles import VIDEO_PROFILES, DEFAULT_VIDEO_PROFILE, THUMBNAIL_INTERVAL, THUMBNAIL_WIDTH, THUMBNAIL_COLUMNS
+
+TRANSCODE_FOURCC = 'mp4v'
+TRANSCODE_EXTENSION = '.mp4'
+DEFAULT_FPS = 30.0  # Used when the container doesn't report a frame rate
+THUMBNAIL_QUALITY = 70
+
+
+def _output_path(file_path, suffix):
+    return os.path.splitext(file_path)[0] + suffix
+
+
+def _thumbnail_sheet(tiles, path):
+    # Lay tiles out row by row; tile k covers k * THUMBNAIL_INTERVAL seconds
+    columns = min(THUMBNAIL_COLUMNS, len(tiles))
+    rows = -(-len(tiles) // columns)
+    height, width = tiles[0].shape[:2]
+    sheet = np.zeros((rows * height, columns * width, 3), dtype=np.uint8)
+    for k, tile in enumerate(tiles):
+        row, column = divmod(k, columns)
+        sheet[row * height:(row + 1) * height, column * width:(column + 1) * width] = tile
+
+    ok, encoded = cv2.imencode('.jpg', sheet, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    if not ok:
+        raise RuntimeError('Could not encode thumbnail strip')
+    with open(path, 'wb') as f:
+        f.write(encoded.tobytes())
+    return {'path': path, 'size': os.path.getsize(path), 'count': len(tiles),
+            'columns': columns, 'width': width, 'height': height, 'interval': THUMBNAIL_INTERVAL}
+
+
+def transcode_recording(file_path, profile=DEFAULT_VIDEO_PROFILE):
+    # Re-encode a recording with a storage profile and build its thumbnail
+    # strip in a single decoding pass. Runs in a worker process and only
+    # touches files; the caller records the result and removes the original.
+    # The transcode is discarded if it isn't smaller than the original.
+    settings = VIDEO_PROFILES[profile]
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        raise RuntimeError(f'Could not open {file_path}')
+
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    if not source_fps or source_fps <= 0 or source_fps > 240:
+        source_fps = DEFAULT_FPS
+    target_fps = min(settings['fps'], source_fps) if settings else source_fps
+
+    video_path = _output_path(file_path, f'_{profile}{TRANSCODE_EXTENSION}')
+    # The extension picks the container, so it stays last
+    partial_path = _output_path(file_path, f'_{profile}.partial{TRANSCODE_EXTENSION}')
+    out = None
+    frame_size = None
+    tiles = []
+    index = 0
+    written = 0
+    try:
+        while True:
+            # Only frames that are kept or become tiles need to be decoded
+            timestamp = index / source_fps
+            keep = settings is not None and int(index * target_fps / source_fps) >= written
+            tile = timestamp >= len(tiles) * THUMBNAIL_INTERVAL
+            if not (keep or tile):
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+
+            ok, frame = cap.read()
+            if not ok:
+                break
+
+            if keep:
+                if out is None:
+                    width = min(settings['width'], frame.shape[1])
+                    height = int(round(frame.shape[0] * width / frame.shape[1] / 2)) * 2
+                    frame_size = (width, height)
+                    out = cv2.VideoWriter(partial_path, cv2.VideoWriter_fourcc(*TRANSCODE_FOURCC), target_fps, frame_size)
+                    if not out.isOpened():
+                        raise RuntimeError(f'Could not open {video_path} for writing')
+                if (frame.shape[1], frame.shape[0]) != frame_size:
+                    frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+                out.write(frame)
+                written += 1
+
+            if tile:
+                height = int(frame.shape[0] * THUMBNAIL_WIDTH / frame.shape[1])
+                tiles.append(cv2.resize(frame, (THUMBNAIL_WIDTH, height), interpolation=cv2.INTER_AREA))
+            index += 1
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+
+    if not tiles:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise RuntimeError(f'No frames could be read from {file_path}')
+
+    original_size = os.path.getsize(file_path)
+    result = {'profile': profile, 'file_path': file_path, 'original_size': original_size, 'stored_size': original_size}
+    if out is not None:
+        if os.path.getsize(partial_path) < original_size:
+            os.replace(partial_path, video_path)
+            result['file_path'] = video_path
+            result['stored_size'] = os.path.getsize(video_path)
+        else:
+            os.remove(partial_path)
+
+    result['thumbnails'] = _thumbnail_sheet(tiles, _output_path(file_path, '_thumbs.jpg'))
+    return result
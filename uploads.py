@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from database import Session
+from models import VideoUpload, VideoRecording
+from analysis_jobs import enqueue_analysis
+from video_writer import WriterBackpressure, WriterClosed
+from recording_supervisor import supervisor, SupervisorFull
+from live_analysis import live_service
+
+UPLOAD_FOLDER = 'static'
+CHUNK_READ_SIZE = 64 * 1024  # Bytes copied from the request stream per write
+MAX_CHUNK_SIZE = 16 * 1024 * 1024  # Largest single chunk a client may push
+ALLOWED_EXTENSIONS = {'.webm', '.mp4', '.avi', '.mkv'}
+MAX_FRAME_SIZE = 2 * 1024 * 1024  # Largest single encoded frame
+UPLOAD_MODES = ('chunks', 'frames')
+
+# Serializes appends to the same upload within this process
+_upload_locks = {}
+_upload_locks_guard = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+def _upload_lock(upload_id):
+    with _upload_locks_guard:
+        lock = _upload_locks.get(upload_id)
+        if lock is None:
+            lock = _upload_locks[upload_id] = threading.Lock()
+        return lock
+
+
+def current_offset(upload):
+    try:
+        return os.path.getsize(upload.file_path)
+    except OSError:
+        return 0
+
+
+def open_upload(session, user_id, question_set, extension='.webm', mode='chunks'):
+    # Reuse the student's open upload for this question set so a reloaded
+    # page resumes the same recording instead of starting a new file. A
+    # frame upload can only be resumed while its writer is still running
+    # on this node; otherwise a new segment is started.
+    uploads = session.query(VideoUpload).filter_by(
+        user_id=user_id, question_set_id=question_set.id, status='open', mode=mode
+    ).all()
+    for upload in uploads:
+        if mode == 'chunks' or supervisor.is_active(upload.id):
+            return upload
+
+    if mode not in UPLOAD_MODES:
+        raise UploadError(f'Unsupported upload mode {mode}')
+    if mode == 'frames':
+        # Frames are encoded on the server
+        extension = '.avi'
+    if extension not in ALLOWED_EXTENSIONS:
+        raise UploadError(f'Unsupported video format {extension}')
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    upload = VideoUpload(
+        id=upload_id,
+        user_id=user_id,
+        admin_id=question_set.admin_id,
+        question_set_id=question_set.id,
+        file_path=os.path.join(UPLOAD_FOLDER, f'{user_id}_test_{question_set.id}_{upload_id}{extension}'),
+        mode=mode,
+        status='open'
+    )
+    if mode == 'frames':
+        try:
+            supervisor.start_session(upload_id, upload.file_path)
+        except SupervisorFull as e:
+            raise UploadError(str(e), 503)
+        live_service.register(upload_id, user_id, question_set.admin_id)
+    session.add(upload)
+    return upload
+
+
+def append_chunk(upload, offset, stream, content_length=None):
+    # Append one chunk from the request stream straight to disk. The client
+    # must send the offset it believes the upload is at; a mismatch returns
+    # the server's offset so the client can resume from there.
+    if upload.status != 'open':
+        raise UploadError('Upload already finalized', 409, current_offset(upload))
+    if upload.mode != 'chunks':
+        raise UploadError('Upload accepts frames, not chunks')
+    if content_length is not None and content_length > MAX_CHUNK_SIZE:
+        raise UploadError('Chunk too large', 413, current_offset(upload))
+
+    with _upload_lock(upload.id):
+        with open(upload.file_path, 'ab') as f:
+            size = f.tell()
+            if offset != size:
+                raise UploadError('Offset mismatch', 409, size)
+
+            written = 0
+            while True:
+                chunk = stream.read(CHUNK_READ_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > MAX_CHUNK_SIZE:
+                    # Drop the partial chunk so the client can retry from the same offset
+                    f.truncate(size)
+                    raise UploadError('Chunk too large', 413, size)
+                f.write(chunk)
+
+            return size + written
+
+
+def push_frame(upload, data):
+    # Queue one encoded frame for the upload's streaming writer
+    if upload.status != 'open':
+        raise UploadError('Upload already finalized', 409)
+    if upload.mode != 'frames':
+        raise UploadError('Upload accepts chunks, not frames')
+    if not data or len(data) > MAX_FRAME_SIZE:
+        raise UploadError('Missing or oversized frame')
+
+    writer = supervisor.get_writer(upload.id)
+    if writer is None:
+        raise UploadError('Recording is not active on this server', 409)
+    try:
+        writer.write_encoded(data)
+    except WriterBackpressure as e:
+        raise UploadError(str(e), 503)
+    except WriterClosed as e:
+        raise UploadError(str(e), 409)
+
+    # A sample of the frames also goes to live analysis
+    live_service.submit(upload.id, data)
+    return writer.frames_received
+
+
+def finalize_upload(session, upload):
+    # Close the upload and turn it into a VideoRecording queued for analysis.
+    # Returns the recording, or None if nothing was recorded or another
+    # process finalized the upload first. The conditional UPDATE makes the
+    # claim safe when reapers in several processes and the student's submit
+    # race for the same upload.
+    claimed = session.query(VideoUpload).filter_by(id=upload.id, status='open').update({
+        'status': 'finalized',
+        'finalized_at': datetime.utcnow()
+    }, synchronize_session='evaluate')
+    with _upload_locks_guard:
+        _upload_locks.pop(upload.id, None)
+    if upload.mode == 'frames':
+        # Flush the frames still buffered before the file is recorded
+        supervisor.stop_session(upload.id)
+        live_service.unregister(upload.id)
+
+    if not claimed or current_offset(upload) == 0:
+        return None
+
+    recording = VideoRecording(
+        user_id=upload.user_id,
+        admin_id=upload.admin_id,
+        question_set_id=upload.question_set_id,
+        file_path=upload.file_path
+    )
+    session.add(recording)
+    session.flush()
+    upload.video_recording_id = recording.id
+    enqueue_analysis(session, recording)
+    return recording
+
+
+def finalize_uploads(session, user_id, question_set_id):
+    # Finalize the student's open uploads for this question set on submit.
+    # Returns the new recordings.
+    uploads = session.query(VideoUpload).filter_by(
+        user_id=user_id, question_set_id=question_set_id, status='open'
+    ).all()
+
+    recordings = []
+    for upload in uploads:
+        recording = finalize_upload(session, upload)
+        if recording:
+            recordings.append(recording)
+    return recordings
+
+
+def reap_abandoned_uploads():
+    # Finalize recordings the student never submitted: sessions on this node
+    # that went idle or ran past the exam time limit, and open uploads whose
+    # file hasn't changed for the idle timeout (e.g. after a restart or on a
+    # node that died). Returns how many were finalized.
+    reaped = 0
+    with Session() as session:
+        for upload_id in supervisor.expired_sessions():
+            upload = session.get(VideoUpload, upload_id)
+            if upload is not None and upload.status == 'open':
+                finalize_upload(session, upload)
+            else:
+                supervisor.stop_session(upload_id)
+            reaped += 1
+
+        idle_cutoff = time.time() - supervisor.idle_timeout
+        candidates = session.query(VideoUpload).filter(
+            VideoUpload.status == 'open',
+            VideoUpload.created_at < datetime.utcnow() - timedelta(seconds=supervisor.idle_timeout)
+        ).all()
+        for upload in candidates:
+            if supervisor.is_active(upload.id):
+                continue
+            try:
+                last_write = os.path.getmtime(upload.file_path)
+            except OSError:
+                last_write = 0
+            if last_write < idle_cutoff:
+                finalize_upload(session, upload)
+                reaped += 1
+
+        session.commit()
+    return reaped
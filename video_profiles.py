@@ -0,0 +1,20 @@
+import os
+
+# Storage settings for finished recordings. They are kept apart from
+# transcode.py so the API can validate and describe them without loading
+# OpenCV; only worker processes import the transcoder.
+
+# Recordings are analysed at full quality first and then re-encoded with
+# their test's profile; 'original' keeps the file as recorded and only
+# builds the thumbnail strip.
+VIDEO_PROFILES = {
+    'original': None,
+    'standard': {'fps': 15, 'width': 640},
+    'compact': {'fps': 10, 'width': 480},
+    'minimal': {'fps': 5, 'width': 320}
+}
+DEFAULT_VIDEO_PROFILE = os.environ.get('VIDEO_PROFILE', 'standard')
+
+THUMBNAIL_INTERVAL = float(os.environ.get('THUMBNAIL_INTERVAL', 10))  # Seconds of video per tile
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_COLUMNS = 10
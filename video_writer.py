@@ -0,0 +1,155 @@
+import queue
+import threading
+import numpy as np
+
+FPS = 30  # Frames per second
+WIDTH = 640  # Video width in pixels
+HEIGHT = 480  # Video height in pixels
+FOURCC = 'XVID'
+
+# Frames queued per session before writers push back. Frames are queued
+# still JPEG/PNG-encoded and decoded on the writer thread, so a full buffer
+# holds BUFFER_FRAMES compressed images rather than raw 640x480 frames.
+BUFFER_FRAMES = 90
+PUT_TIMEOUT = 0.5  # Seconds a producer waits for buffer space
+# Frames a writer handles before yielding its pool thread to other sessions
+DRAIN_BATCH = 30
+
+_CLOSE = object()
+
+
+class WriterBackpressure(Exception):
+    pass
+
+
+class WriterClosed(Exception):
+    pass
+
+
+class StreamingVideoWriter:
+    # Encodes one session's frames to disk incrementally. Producers put frames
+    # into a bounded queue; whenever frames are waiting, a drain task runs on
+    # the shared executor to decode and write them. Memory per session stays
+    # constant however long the exam runs, and no thread is tied to a session.
+    def __init__(self, path, executor, fps=FPS, frame_size=(WIDTH, HEIGHT), fourcc=FOURCC, buffer_frames=BUFFER_FRAMES):
+        self.path = path
+        self.fps = fps
+        self.frame_size = frame_size
+        self.fourcc = fourcc
+        self.frames_received = 0
+        self.frames_written = 0
+        self.frames_invalid = 0
+        self.error = None
+        self._executor = executor
+        self._queue = queue.Queue(maxsize=buffer_frames)
+        self._out = None
+        self._closed = False
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, frame, timeout=PUT_TIMEOUT):
+        # Raw BGR frame (numpy array)
+        self._put(frame, timeout)
+
+    def write_encoded(self, data, timeout=PUT_TIMEOUT):
+        # JPEG/PNG bytes, decoded on the writer thread
+        self._put(bytes(data), timeout)
+
+    def _put(self, item, timeout):
+        if self._closed:
+            raise WriterClosed('Video writer is closed')
+        if self.error:
+            raise WriterClosed(f'Video writer failed: {self.error}')
+        try:
+            self._queue.put(item, timeout=timeout)
+        except queue.Full:
+            raise WriterBackpressure('Video writer buffer is full')
+        self.frames_received += 1
+        self._schedule()
+
+    def close(self, timeout=None):
+        # Flush everything queued so far and release the file. Returns True if
+        # the writer finished cleanly.
+        with self._lock:
+            already_closed = self._closed
+            self._closed = True
+        if not already_closed:
+            self._queue.put(_CLOSE)
+            self._schedule()
+        self._done.wait(timeout)
+        return self._done.is_set() and self.error is None
+
+    def _schedule(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._submit()
+
+    def _submit(self):
+        try:
+            self._executor.submit(self._drain)
+        except RuntimeError:
+            # The pool is already shut down at interpreter exit; finish
+            # writing on this thread instead
+            self._drain()
+
+    def _drain(self):
+        for _ in range(DRAIN_BATCH):
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._scheduled = False
+                        return
+                continue
+
+            if item is _CLOSE:
+                self._release()
+                return
+            try:
+                self._write(item)
+            except Exception as e:
+                self.error = str(e)
+
+        # Give other sessions a turn before writing the rest
+        self._submit()
+
+    def _write(self, item):
+        # OpenCV is loaded with the first recording, so API processes that
+        # never encode video don't pay for it
+        import cv2
+        if self.error:
+            # Keep draining so producers and close() never block
+            return
+        if self._out is None:
+            self._out = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.frame_size)
+            if not self._out.isOpened():
+                self.error = f'Could not open {self.path} for writing'
+                return
+
+        frame = item
+        if isinstance(item, bytes):
+            frame = cv2.imdecode(np.frombuffer(item, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                self.frames_invalid += 1
+                return
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        self._out.write(frame)
+        self.frames_written += 1
+
+    def _release(self):
+        if self._out is not None:
+            self._out.release()
+        self._done.set()
@@ -0,0 +1,86 @@
+import argparse
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from database import Session
+from models import engine, create_schema, VideoRecording
+from analysis import analyze_video, DEFAULT_STRIDE
+from analysis_jobs import claim_job, complete_job, fail_job, release_job, requeue_stale_jobs, face_detector_for, JOB_LEASE_SECONDS
+from transcode import transcode_recording
+from retention import video_profile_for, purge_expired_recordings
+from instrumentation import logger, record_error
+
+
+def run(processes, poll_interval, lease_seconds, stride=DEFAULT_STRIDE, once=False):
+    # The parent process owns the database; pool processes only run the
+    # analysis and transcoding so SQLite never sees writes from more than one
+    # process here.
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    in_flight = {}
+    last_requeue = 0
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        try:
+            while True:
+                with Session() as session:
+                    if time.monotonic() - last_requeue > poll_interval * 10:
+                        requeue_stale_jobs(session, lease_seconds)
+                        purge_expired_recordings(session)
+                        last_requeue = time.monotonic()
+
+                    # Keep every pool process busy
+                    while len(in_flight) < processes:
+                        job = claim_job(session, worker)
+                        if not job:
+                            break
+                        video = session.get(VideoRecording, job.video_recording_id)
+                        if job.kind == 'transcode':
+                            future = pool.submit(transcode_recording, video.file_path, video_profile_for(session, video))
+                        else:
+                            future = pool.submit(analyze_video, video.file_path, stride, face_detector_for(session, video))
+                        in_flight[future] = job.id
+
+                if not in_flight:
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                with Session() as session:
+                    for future in done:
+                        job_id = in_flight.pop(future)
+                        try:
+                            complete_job(session, job_id, future.result())
+                        except Exception as e:
+                            session.rollback()
+                            record_error('analysis_worker', e)
+                            logger.exception('Job %s failed', job_id)
+                            fail_job(session, job_id, e)
+        finally:
+            # Give unfinished jobs back to the queue on shutdown
+            with Session() as session:
+                for job_id in in_flight.values():
+                    release_job(session, job_id)
+            for future in in_flight:
+                future.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run proctoring analysis and transcoding jobs for finished recordings.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--lease-seconds', type=int, default=JOB_LEASE_SECONDS)
+    parser.add_argument('--stride', type=int, default=DEFAULT_STRIDE,
+                        help='Analyze every Nth frame outside of changes (1 analyzes every frame)')
+    parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    create_schema(engine)
+    try:
+        run(args.processes, args.poll_interval, args.lease_seconds, stride=args.stride, once=args.once)
+    except KeyboardInterrupt:
+        pass